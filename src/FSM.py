@@ -1,16 +1,25 @@
 from enum import Enum
-import struct
-import socket
 from collections import defaultdict, namedtuple
+import heapq
 import time
+from util.merkle import merkle_proof
+from util.packet import DataPacker, CHUNK_DATA_SIZE, MIN_PAYLOAD
+from util.bt_utils import RTO_MIN, RTO_MAX, SEND_TTL
+from congestion import Reno
 
-MAX_PAYLOAD = 1024
-MAGIC = 52305
-TEAM = 29
-CHUNK_DATA_SIZE = 512 * 1024
-HEADER_LEN = struct.calcsize("HBBHHII")
-DATA = 3
-TTL = 5
+DUP_THRESH = 3
+# lower bound of the RTT variation term of an estimated timeout, timers fire on time
+# so a timeout of exactly the RTT would expire before the ACK arrives
+CLOCK_GRANULARITY = 0.1
+# a flow to a peer whose last flow was updated within WARM_START_MAX_IDLE seconds starts
+# from half its cwnd, halved again per RTO of idle time (RFC 2861)
+WARM_START_MAX_IDLE = 5
+WARM_START_MIN_CWND = 2
+# pacing: window releases are spread at gain * cwnd / RTT pkts per second,
+# with bursts of at most PACING_BURST pkts
+PACING_SS_GAIN = 2
+PACING_CA_GAIN = 1.25
+PACING_BURST = 4
 
 Timer = namedtuple('Timer', ['seq', 'send_time'])
 
@@ -32,18 +41,63 @@ class FSM():
     Finate state machine of peers who have established a connection.
     Initialized when receiving a GET packet from a peer, and expires
     when the whole chunk is successfully sent.
+    With selective_repeat, every in-flight pkt is timed on its own and only
+    pkts inferred lost (by timeout or SACK) are retransmitted, otherwise
+    the sender falls back to Go-Back-N.
+    With merkle_tree, every DATA pkt carries the merkle proof of its payload
+    as a header extension.
+    With pkt_cache, DATA pkts are taken from the DataPacketCache shared by all FSMs.
+    cc is the CongestionControl deciding cwnd, Reno by default.
+    payload_size is the DATA payload negotiated in GET, seq i carries bytes
+    [(i - 1) * payload_size, i * payload_size) of the chunk.
+    start_seq is the num of pkts the receiver already has in order (a ranged GET),
+    the first transit() is given it as the ACK and sending starts right after it.
+    With timers, the retransmission deadline is kept armed in the TimerHeap
+    under (addr, flow_id), and expire() is called when it is due.
+    With path_cache, the RTT estimate starts from the last one of the peer and
+    is saved back once the chunk is fully acked, so is cwnd, which is warm started
+    if the last flow to the peer finished recently. Flows still running or given up
+    leave the cache alone, so a new flow never starts from the middle of a recovery.
+    RTT is only sampled on pkts sent once (Karn), and timeouts are kept within
+    [rto_min, rto_max].
+    With pacing and timers, once an RTT estimate exists (or cc has a pacing rate)
+    pkts leave through a token bucket instead of a window at a time, the bucket
+    is refilled by a timer under the FSM itself, and pace() is called when it is due.
     '''
-    def __init__(self, addr, chunkhash_str, chunkdata, timeout, logger) -> None:
+    def __init__(self, addr, chunkhash_str, chunkdata, timeout, logger, selective_repeat=False, merkle_tree=None,
+                 flow_id=0, timers=None, pkt_cache=None, payload_size=MIN_PAYLOAD, cc=None, pacing=False,
+                 path_cache=None, rto_min=RTO_MIN, rto_max=RTO_MAX, ttl=SEND_TTL, start_seq=0) -> None:
         self.__addr = addr                               # peer's address, (ip, port)
+        self.__flow_id = flow_id                         # chosen by the peer in GET, echoed in the ack field of DATA
+        self.__timers = timers                           # TimerHeap shared by all flows
 
         self.__sending_chunkhash_str = chunkhash_str     # the chunkhash str of the chunk being sent to the peer
-        self.__sending_chunkdata = chunkdata             # the data of the chunk being sent to the peer
+        self.__sending_chunkdata = memoryview(chunkdata) # the data of the chunk being sent to the peer
+        self.__packer = DataPacker()                     # reusable buffer DATA pkts are built in
+        self.__pkt_cache = pkt_cache
+        self.__merkle_tree = merkle_tree                 # levels of the merkle tree of the chunk, if proofs are requested
+        self.__payload_size = payload_size               # payload of every DATA pkt but the last one
+        self.__num_pkts = (CHUNK_DATA_SIZE + payload_size - 1) // payload_size
 
-        self.__estimated_RTT = 1                         # estimated RTT, only useful when timeout not set
+        self.__path_cache = path_cache                   # PathCache shared by all FSMs
+        self.__rto_min = rto_min
+        self.__rto_max = max(rto_max, timeout)
+        self.__estimated_RTT = 1                         # estimated RTT
         self.__dev_RTT = 0                               # RTT deviation, only useful when timeout not set
+        self.__min_RTT = None
+        self.__has_RTT = False                           # whether __estimated_RTT comes from a sample
+        path = path_cache.get(addr) if path_cache is not None else None
+        if path is not None:
+            # a known peer, no need to learn its RTT again
+            self.__estimated_RTT = path.srtt
+            self.__dev_RTT = path.rttvar
+            self.__min_RTT = path.min_rtt
+            self.__has_RTT = True
         if timeout == 0:
             # estimate timeout via RTT
-            self.timeout = self.__estimated_RTT
+            self.timeout = self.__estimated_RTT + CLOCK_GRANULARITY
+            if path is not None:
+                self.timeout = self.__clamp_rto(self.__estimated_RTT + max(CLOCK_GRANULARITY, 4 * self.__dev_RTT))
             self.__estimate_timeout = True
         else:
             # use set timeout
@@ -53,18 +107,34 @@ class FSM():
 
         self.__logger = logger
 
-        self.cwnd = 0                                  # congestion window
+        self.cc = cc if cc is not None else Reno()       # owns cwnd and ssthresh
+        if path is not None:
+            self.__warm_start(path)
+        self.__rtt_sample = None                         # RTT sample not yet reported to cc
+        self.__pacing = pacing and timers is not None
+        self.__tokens = PACING_BURST                     # pkts that may leave right now when paced
+        self.__token_time = time.perf_counter()          # when __tokens was last refilled
         self.__unacked = 1                               # num of sent but unacked pkt
-        self.__ssthresh = 64                             # ssthresh
         self.__dup_acks = defaultdict(int)               # duplicate ack num per seq-ack round
-        self.__new_acks = 0                              # num of new acks, only used in congestion avoidance
-        self.__last_ack = -1                             # the last acked seq
-        self.__last_sent = 0                             # the last sent pkt seq
+        self.__last_ack = start_seq - 1                  # the last acked seq
+        self.__last_sent = start_seq                     # the last sent pkt seq
+        self.__highest_sent = start_seq                  # pkts up to this seq have been sent at least once
 
         self.timer = Timer(-1, -1)                       # always times the lask unacked pkt 
         self.state = State.SLOW_START
 
-        self.ttl = TTL 
+        # selective repeat scoreboard
+        self.__selective_repeat = selective_repeat
+        self.__in_flight = dict()                        # seq -> send time of sent but not acked/sacked pkts, oldest first
+                                                         # with GBN, only used for RTT samples
+        self.__sacked = set()                            # seqs above last ack that the receiver has buffered
+        self.__lost = []                                 # heap of seqs inferred lost and waiting for retransmission
+        self.__retransmitted = set()                     # seqs that have been retransmitted, never used as RTT samples
+
+        self.__max_ttl = ttl
+        self.ttl = ttl                                   # retransmits left before the receiver is considered gone
+        self.last_ack_time = time.perf_counter()         # liveness of the receiver, any ACK counts
+        self.__ttl_time = self.last_ack_time             # when ttl was last decremented or reset
 
         # {old state: {event: event handler(sock, pkt) -> new state}}
         self.transition_table = {
@@ -74,80 +144,299 @@ class FSM():
         } 
         self.__add_event_handler()
 
-    def transit(self, sock, ack_num):
+    def transit(self, sock, ack_num, sack_ranges=()):
         self.__logger.info(f'last ack: {self.__last_ack}, ack: {ack_num}')
+        # the receiver is alive
+        self.ttl = self.__max_ttl
+        self.last_ack_time = self.__ttl_time = time.perf_counter()
+        if self.__selective_repeat:
+            self.__update_scoreboard(ack_num, sack_ranges)
         if ack_num <= self.__last_ack:
             event = Event.DUP_ACK
-        elif ack_num == 512:
+        elif ack_num == self.__num_pkts:
             self.state = State.FINISHED
+            self.__save_path()
+            if self.__timers is not None:
+                self.__timers.cancel((self.__addr, self.__flow_id))
+                self.__timers.cancel(self)
             self.__logger.info(f"finished sending {self.__sending_chunkhash_str}")
             return
         else:
             event = Event.NEW_ACK
             # restart timer
-            # now we use GBN, so we just need to time next one 
-            # if we implement selective retransmission we need to time the next unack seq
-            self.timer = Timer(ack_num + 1, time.perf_counter())
-            self.ttl = TTL
+            # GBN just needs to time next one, selective repeat times the oldest in-flight pkt
+            if not self.__selective_repeat:
+                self.__sample_gbn(ack_num)
+                self.timer = Timer(ack_num + 1, time.perf_counter())
 
         self.__logger.info(f'state: {self.state}, event: {event}')
         self.state = self.transition_table[self.state][event](sock, ack_num)
+        if self.__selective_repeat:
+            self.__restart_timer()
+        self.__rearm()
 
-    def __send_data(self, sock, ack_num):
-        # estimate RTT
-        if self.timer.seq == ack_num:
-            sample_RTT = time.perf_counter() - self.timer.send_time
-            if self.__estimate_timeout:
-                self.__estimated_RTT = 0.875 * self.__estimated_RTT + 0.125 * sample_RTT
-                self.__dev_RTT = 0.75 * self.__dev_RTT + 0.25 * abs(sample_RTT - self.__estimated_RTT)
-                self.timeout = self.__estimated_RTT + 4 * self.__dev_RTT
-            else:
-                self.timeout = self.__original_timeout
+    def expire(self, sock):
+        '''
+        The timer is due, retransmit and back off.
+        '''
+        self.state = self.transition_table[self.state][Event.TIMEOUT](sock, self.timer.seq - 1)
+        # double the timeout interval, up to rto_max
+        self.timeout = min(self.timeout * 2, self.__rto_max)
+        self.__rearm()
+
+    def pace(self, sock):
+        '''
+        The pacing timer is due, send what the window allows.
+        '''
+        self.__send_window(sock)
+        if self.__selective_repeat:
+            self.__restart_timer()
+        self.__rearm()
+
+    def __rearm(self):
+        if self.__timers is None:
+            return
+        if not self.__in_flight:
+            # nothing to time, e.g. the window or pacing holds the next pkt back,
+            # __send_pkt arms the timer again
+            self.__timers.cancel((self.__addr, self.__flow_id))
+            return
+        self.__timers.schedule((self.__addr, self.__flow_id), self.timer.send_time + self.timeout)
+
+    def __update_scoreboard(self, ack_num, sack_ranges):
+        '''
+        Selective repeat only. Remove cumulatively acked and sacked pkts from
+        the in-flight set, take an RTT sample and infer lost pkts: a pkt is lost
+        once DUP_THRESH pkts sent after it have been sacked.
+        '''
+        now = time.perf_counter()
+        if ack_num in self.__in_flight and ack_num not in self.__retransmitted:
+            self.__update_timeout(now - self.__in_flight[ack_num])
+        for seq in [seq for seq in self.__in_flight if seq <= ack_num]:
+            self.__in_flight.pop(seq)
+        for start, end in sack_ranges:
+            for seq in range(max(start, ack_num + 1), end + 1):
+                self.__sacked.add(seq)
+                self.__in_flight.pop(seq, None)
+        if ack_num > self.__last_ack:
+            self.__sacked = {seq for seq in self.__sacked if seq > ack_num}
+
+        if not self.__sacked:
+            return
+        sacked_above = sorted(self.__sacked, reverse=True)
+        for seq in sorted(self.__in_flight):
+            if seq in self.__retransmitted:
+                # a lost retransmission can only be detected by timeout
+                continue
+            while sacked_above and sacked_above[-1] < seq:
+                sacked_above.pop()
+            if len(sacked_above) < DUP_THRESH:
+                break
+            self.__mark_lost(seq)
+
+    def __mark_lost(self, seq):
+        if self.__in_flight.pop(seq, None) is not None:
+            heapq.heappush(self.__lost, seq)
+
+    def __next_lost(self):
+        while self.__lost:
+            seq = heapq.heappop(self.__lost)
+            if seq > self.__last_ack and seq not in self.__sacked and seq not in self.__in_flight:
+                return seq
+        return None
+
+    def __restart_timer(self):
+        if self.__in_flight:
+            seq = next(iter(self.__in_flight))
+            self.timer = Timer(seq, self.__in_flight[seq])
+        else:
+            # nothing in flight, keep the timer quiet
+            self.timer = Timer(self.__last_ack + 1, time.perf_counter())
+
+    @property
+    def cwnd(self):
+        # congestion window
+        return self.cc.cwnd
+
+    def __delivered(self, ack_num):
+        # pkts the receiver has, sacked ones are counted as they arrive
+        return ack_num + len(self.__sacked)
+
+    def __take_rtt_sample(self):
+        sample, self.__rtt_sample = self.__rtt_sample, None
+        return sample
+
+    def __update_timeout(self, sample_RTT):
+        self.__rtt_sample = sample_RTT
+        if self.__has_RTT:
+            self.__estimated_RTT = 0.875 * self.__estimated_RTT + 0.125 * sample_RTT
+            self.__dev_RTT = 0.75 * self.__dev_RTT + 0.25 * abs(sample_RTT - self.__estimated_RTT)
+        else:
+            # the first sample, as in RFC 6298
+            self.__estimated_RTT = sample_RTT
+            self.__dev_RTT = sample_RTT / 2
+            self.__has_RTT = True
+        self.__min_RTT = sample_RTT if self.__min_RTT is None else min(self.__min_RTT, sample_RTT)
+        if self.__estimate_timeout:
+            self.timeout = self.__clamp_rto(self.__estimated_RTT + max(CLOCK_GRANULARITY, 4 * self.__dev_RTT))
+        else:
+            self.timeout = self.__original_timeout
+
+    def __warm_start(self, path):
+        idle = time.time() - path.updated
+        if idle > WARM_START_MAX_IDLE:
+            return
+        rto = path.srtt + max(CLOCK_GRANULARITY, 4 * path.rttvar)
+        cwnd = int(path.cwnd / 2 / 2 ** int(idle / rto))
+        if cwnd < WARM_START_MIN_CWND:
+            return
+        # the first transit() opens one more pkt
+        self.cc.warm_start(cwnd - 1, max(path.ssthresh, cwnd * 3 // 4))
+        self.__logger.info(f'warm start to {self.__addr}, cwnd: {cwnd}, ssthresh: {self.cc.ssthresh}')
+
+    def __clamp_rto(self, timeout):
+        return min(max(timeout, self.__rto_min), self.__rto_max)
+
+    def __save_path(self):
+        if self.__path_cache is not None and self.__has_RTT:
+            self.__path_cache.update(self.__addr, self.__estimated_RTT, self.__dev_RTT, self.__min_RTT,
+                                     self.cwnd, self.cc.ssthresh)
+
+    def __sample_gbn(self, ack_num):
+        # send time of the newly acked pkt, unless it has been sent more than once
+        send_time = self.__in_flight.get(ack_num)
+        if send_time is not None and ack_num not in self.__retransmitted:
+            self.__update_timeout(time.perf_counter() - send_time)
+        for seq in [seq for seq in self.__in_flight if seq <= ack_num]:
+            self.__in_flight.pop(seq)
+
+    def __pacing_rate(self):
+        # pkts per second, None if not paced
+        if not self.__pacing:
+            return None
+        rate = self.cc.pacing_rate
+        if rate is None and self.__has_RTT:
+            gain = PACING_SS_GAIN if self.cc.in_slow_start else PACING_CA_GAIN
+            rate = gain * max(self.cwnd, 1) / max(self.__estimated_RTT, 1e-3)
+        return rate
+
+    def __take_token(self):
+        '''
+        Whether a pkt may leave now, otherwise the pacing timer is armed for when it may.
+        '''
+        rate = self.__pacing_rate()
+        if rate is None:
+            return True
+        now = time.perf_counter()
+        self.__tokens = min(PACING_BURST, self.__tokens + (now - self.__token_time) * rate)
+        self.__token_time = now
+        if self.__tokens >= 1:
+            self.__tokens -= 1
+            return True
+        self.__timers.schedule(self, now + (1 - self.__tokens) / rate)
+        return False
+
+    @property
+    def __pipe(self):
+        # num of pkts considered in the network
+        if self.__selective_repeat:
+            return len(self.__in_flight)
+        return self.__unacked
+
+    def __build_pkt(self, seq):
+        left = (seq - 1) * self.__payload_size
+        right = min(seq * self.__payload_size, CHUNK_DATA_SIZE)
+        # |header|merkle proof|payload|, header len covers the proof
+        proof = merkle_proof(self.__merkle_tree, seq - 1) if self.__merkle_tree else b''
+        return self.__packer.pack(seq, self.__flow_id, self.__sending_chunkdata[left: right], proof)
+
+    def __send_pkt(self, sock, seq):
+        if self.__pkt_cache is not None:
+            key = (self.__sending_chunkhash_str, self.__payload_size, seq, self.__merkle_tree is not None)
+            pkt = self.__pkt_cache.get(key, self.__flow_id, lambda: self.__build_pkt(seq))
+        else:
+            pkt = self.__build_pkt(seq)
+        sock.sendto(pkt, self.__addr)
+        if seq <= self.__highest_sent:
+            # Karn's rule, an ACK of it may be for any of its copies
+            self.__retransmitted.add(seq)
+        self.__highest_sent = max(self.__highest_sent, seq)
+        # re-inserting moves seq to the end, so the dict stays ordered by send time
+        self.__in_flight.pop(seq, None)
+        self.__in_flight[seq] = time.perf_counter()
+        if self.__timers is not None and (self.__addr, self.__flow_id) not in self.__timers:
+            # the first pkt in flight, time it
+            self.timer = Timer(seq, self.__in_flight[seq])
+            self.__timers.schedule((self.__addr, self.__flow_id), self.timer.send_time + self.timeout)
+
+    def __retransmit(self, sock, seq):
+        self.__retransmitted.add(seq)
+        self.__send_pkt(sock, seq)
 
+    def __send_data(self, sock, ack_num):
         # self.timer = Timer(ack_num + 1, time.perf_counter())
-        
-        if self.__last_sent * MAX_PAYLOAD >= CHUNK_DATA_SIZE:
+        self.__send_window(sock)
+
+    def __send_window(self, sock):
+        if self.__selective_repeat:
+            # lost pkts go before new data
+            while self.__pipe < self.cwnd:
+                seq = self.__next_lost()
+                if seq is None:
+                    break
+                if not self.__take_token():
+                    heapq.heappush(self.__lost, seq)
+                    return
+                self.__retransmit(sock, seq)
+                self.__logger.info(f'selective retransmit DATA pkt to {self.__addr}, seq: {seq}')
+
+        if self.__last_sent >= self.__num_pkts:
             return
         # received a new ACK, send data until cwnd is full
-        self.__logger.info(f'before sending, unacked: {self.__unacked}, cwnd: {self.cwnd}')
-        while self.__unacked < self.cwnd:
-            left = self.__last_sent * MAX_PAYLOAD
-            right = min((self.__last_sent + 1) * MAX_PAYLOAD, CHUNK_DATA_SIZE)
-            next_data = self.__sending_chunkdata[left: right]
+        self.__logger.info(f'before sending, unacked: {self.__pipe}, cwnd: {self.cwnd}')
+        while self.__pipe < self.cwnd and self.__last_sent < self.__num_pkts and self.__take_token():
             # send next data
-            data_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, DATA, socket.htons(HEADER_LEN),
-                                    socket.htons(HEADER_LEN + len(next_data)), socket.htonl(self.__last_sent + 1), 0)
-            sock.sendto(data_header + next_data, self.__addr)
+            self.__send_pkt(sock, self.__last_sent + 1)
             self.__logger.info(f'sent DATA pkt to {self.__addr}, seq: {self.__last_sent + 1}')
             self.__unacked += 1
             self.__last_sent += 1
         # self.__logger.info(f'finished sending, unacked: {self.__unacked}, cwnd: {self.__cwnd}')
 
     def __fast_retransmit(self, sock, ack_num):
-        left = ack_num * MAX_PAYLOAD
-        right = min((ack_num + 1) * MAX_PAYLOAD, CHUNK_DATA_SIZE)
-        retransmit_data = self.__sending_chunkdata[left: right]
+        if self.__selective_repeat:
+            # only resend the hole, pkts after it are buffered by the receiver
+            if ack_num + 1 not in self.__sacked:
+                self.__retransmit(sock, ack_num + 1)
+            self.__logger.info(f'fast retransmit DATA pkt to {self.__addr}, seq: {ack_num + 1}')
+            return
         # send retransmitted data
-        data_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, DATA, socket.htons(HEADER_LEN),
-                                    socket.htons(HEADER_LEN + len(retransmit_data)), socket.htonl(ack_num + 1), 0)
-        sock.sendto(data_header + retransmit_data, self.__addr)
+        self.__send_pkt(sock, ack_num + 1)
         self.__unacked = 1
         self.__last_sent = ack_num + 1
         self.__logger.info(f'fast retransmit DATA pkt to {self.__addr}, seq: {ack_num + 1}')
 
     def __timeout_retransmit(self, sock, ack_num):
-        left = (self.timer.seq - 1) * MAX_PAYLOAD
-        right = min(self.timer.seq * MAX_PAYLOAD, CHUNK_DATA_SIZE)
-        retransmit_data = self.__sending_chunkdata[left: right]
-        # send retransmitted data
-        data_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, DATA, socket.htons(HEADER_LEN),
-                                    socket.htons(HEADER_LEN + len(retransmit_data)), socket.htonl(self.timer.seq), 0)
-        sock.sendto(data_header + retransmit_data, self.__addr)
-        # restart timer
-        self.timer = Timer(self.timer.seq, time.perf_counter())
-
-        # change ttl to check if alive
-        self.ttl -= 1 
+        if self.__selective_repeat:
+            # every pkt whose own timer expired is lost, the oldest one is resent now
+            # and the rest as the window opens again
+            now = time.perf_counter()
+            for seq in [seq for seq, send_time in self.__in_flight.items() if now - send_time > self.timeout]:
+                self.__mark_lost(seq)
+            if self.timer.seq > self.__last_ack and self.timer.seq not in self.__sacked:
+                self.__retransmit(sock, self.timer.seq)
+            self.__restart_timer()
+        else:
+            # send retransmitted data
+            self.__send_pkt(sock, self.timer.seq)
+            # restart timer
+            self.timer = Timer(self.timer.seq, time.perf_counter())
+
+        # change ttl to check if alive, once per timeout interval as selective repeat
+        # may expire several pkts sent around the same time in a row
+        now = time.perf_counter()
+        if now - self.__ttl_time >= self.timeout:
+            self.ttl -= 1
+            self.__ttl_time = now
         self.__logger.info(f'timeout retransmit DATA pkt to {self.__addr}, seq: {self.timer.seq}')
 
     def __add_event_handler(self):
@@ -172,23 +461,21 @@ class FSM():
 
     def __slow_start_new_ack(self, sock, ack_num):
         self.__unacked -= (ack_num - self.__last_ack)
-        self.cwnd += (ack_num - self.__last_ack)
+        self.cc.on_ack(ack_num - self.__last_ack, self.__take_rtt_sample(), self.__delivered(ack_num))
         self.__last_ack = ack_num
         # self.__logger.info(f'slow start new ack, unacked: {self.__unacked}, cwnd: {self.__cwnd}')
         self.__send_data(sock, ack_num)
-        if self.cwnd >= self.__ssthresh:
+        if not self.cc.in_slow_start:
             return self.transition_table[State.SLOW_START][Event.CWND_TOO_LARGE](sock, ack_num)
         return State.SLOW_START
 
     def __slow_start_three_dup_ack(self, sock, ack_num):
-        self.__ssthresh = max(self.cwnd // 2, 2)
-        self.cwnd = self.__ssthresh + 3
+        self.cc.on_loss()
         self.__fast_retransmit(sock, ack_num)
         return State.Fast_RECOVERY
 
     def __slow_start_timeout(self, sock, ack_num):
-        self.__ssthresh = max(self.cwnd // 2, 2)
-        self.cwnd = 1
+        self.cc.on_timeout()
         self.__timeout_retransmit(sock, ack_num)
         return State.SLOW_START
 
@@ -196,12 +483,9 @@ class FSM():
         return State.CONGESTION_AVOIDANCE
 
     def __congestion_avoidance_new_ack(self, sock, ack_num):
-        self.__new_acks += (ack_num - self.__last_ack)
         self.__unacked -= (ack_num - self.__last_ack)
+        self.cc.on_ack(ack_num - self.__last_ack, self.__take_rtt_sample(), self.__delivered(ack_num))
         self.__last_ack = ack_num
-        if self.__new_acks >= self.cwnd:
-            self.cwnd += 1
-            self.__new_acks = 0
         self.__logger.info(f'congestion avoidance new ack, unacked: {self.__unacked}, cwnd: {self.cwnd}')
         self.__send_data(sock, ack_num)
         return State.CONGESTION_AVOIDANCE
@@ -213,32 +497,31 @@ class FSM():
         return State.CONGESTION_AVOIDANCE
 
     def __congestion_avoidance_three_dup_ack(self, sock, ack_num):
-        self.__ssthresh = max(self.cwnd // 2, 2)
-        self.cwnd = self.__ssthresh + 3
-        self.__new_acks = 0
+        self.cc.on_loss()
         self.__fast_retransmit(sock, ack_num)
         return State.Fast_RECOVERY
     
     def __fast_recovery_new_ack(self, sock, ack_num):
         self.__dup_acks[ack_num] = 0
-        self.cwnd = self.__ssthresh
+        self.cc.on_recovery_end()
+        if self.__selective_repeat:
+            # the hole is filled, keep the pipe going with the remaining lost pkts and new data
+            self.__last_ack = ack_num
+            self.__send_data(sock, ack_num)
         return State.CONGESTION_AVOIDANCE
 
     def __fast_recovery_dup_ack(self, sock, ack_num): 
-        self.cwnd += 1
+        self.cc.on_dup_ack()
         self.__send_data(sock, ack_num)
         return State.Fast_RECOVERY
 
     def __fast_recovery_timeout(self, sock, ack_num):
-        self.__ssthresh = max(self.cwnd // 2, 2)
-        self.cwnd = 1
+        self.cc.on_timeout()
         self.__dup_acks[ack_num] = 0
         self.__timeout_retransmit(sock, ack_num)
         return State.SLOW_START
 
     def __congestion_avoidance_timeout(self, sock, ack_num):
-        self.__ssthresh = max(self.cwnd // 2, 2)
-        self.cwnd = 1
-        self.__new_acks = 0
+        self.cc.on_timeout()
         self.__timeout_retransmit(sock, ack_num)
         return State.SLOW_START
\ No newline at end of file
@@ -0,0 +1,71 @@
+import os
+import mmap
+from util.chunk_store import FragmentWriter
+from util.packet import CHUNK_DATA_SIZE
+
+class ChunkWriter():
+    '''
+    Output stage of a DOWNLOAD.
+    Every verified chunk is written into its own slot of a memory-mapped
+    spool file next to the output file as soon as it completes, so the peer
+    never holds finished chunks in the heap. When the whole DOWNLOAD is done
+    the spool is exported as the pickled {chunkhash_str: chunkdata} dict
+    that the test scripts read, one chunk at a time.
+    With resume, the spool file of an interrupted DOWNLOAD of the same chunks
+    is reused if it exists, resumed tells whether it did.
+    '''
+    def __init__(self, output_file, chunkhash_strs, chunk_size=CHUNK_DATA_SIZE, resume=False) -> None:
+        self.output_file = output_file
+        self.spool_file = output_file + '.part'
+        self.chunk_size = chunk_size
+        self.index = {chunkhash_str: slot for slot, chunkhash_str in enumerate(chunkhash_strs)}  # hashstr to slot
+        self.written = set()
+
+        size = max(len(self.index), 1) * chunk_size
+        self.resumed = resume and os.path.exists(self.spool_file) and os.path.getsize(self.spool_file) == size
+        self.__file = open(self.spool_file, 'r+b' if self.resumed else 'w+b')
+        # sparse file, pages are only backed once a chunk is written
+        self.__file.truncate(size)
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0)
+        self.__view = memoryview(self.__mmap)
+
+    def write(self, chunkhash_str, data):
+        offset = self.index[chunkhash_str] * self.chunk_size
+        self.__view[offset: offset + len(data)] = data
+        self.written.add(chunkhash_str)
+
+    def stage(self, chunkhash_str, data, start):
+        '''
+        Write part of an unfinished chunk at start in its slot.
+        '''
+        offset = self.index[chunkhash_str] * self.chunk_size + start
+        self.__view[offset: offset + len(data)] = data
+
+    def flush(self):
+        # written and staged data reaches the disk
+        self.__mmap.flush()
+
+    def read(self, chunkhash_str):
+        '''
+        Zero-copy view of a written chunk, valid as long as the writer lives.
+        '''
+        offset = self.index[chunkhash_str] * self.chunk_size
+        return self.__view[offset: offset + self.chunk_size]
+
+    def export(self):
+        '''
+        Dump written chunks to output_file in pickle format, without building
+        the dict in memory. The file is renamed into place once complete, so
+        readers never see a partial pickle.
+        '''
+        tmp_file = self.output_file + '.tmp'
+        with open(tmp_file, 'wb') as wf:
+            fragment = FragmentWriter(wf)
+            for chunkhash_str in self.index:
+                if chunkhash_str in self.written:
+                    fragment.add(chunkhash_str, self.read(chunkhash_str))
+            fragment.close()
+        os.replace(tmp_file, self.output_file)
+        self.__mmap.flush()
+        # the mapping stays valid after unlink, so chunks can still be served from it
+        os.remove(self.spool_file)
@@ -0,0 +1,297 @@
+import time
+from abc import ABC, abstractmethod
+from enum import Enum
+from collections import deque
+
+'''
+Congestion controllers of a sending flow. The FSM keeps the loss recovery
+states and reports to its controller:
+    on_ack(acked, rtt, delivered)
+                        acked new pkts were cumulatively acked, rtt is a fresh RTT sample or None,
+                        delivered counts every pkt acked or sacked so far
+    on_dup_ack()        a dup ACK during fast recovery, a pkt has left the network
+    on_loss()           three dup ACKs, fast recovery begins
+    on_recovery_end()   the lost pkt is acked, fast recovery ends
+    on_timeout()        the retransmission timer expired
+    warm_start(cwnd, ssthresh)
+                        before the first ACK, start from the state of a recent flow to the same peer
+and sends as long as the pipe is below cwnd (in pkts). pacing_rate is in
+pkts per second, None if the controller does not pace.
+'''
+
+INITIAL_SSTHRESH = 64
+
+class CongestionControl(ABC):
+    def __init__(self) -> None:
+        # the first on_ack(1) of the FSM opens the window to 1
+        self.cwnd = 0
+        self.ssthresh = INITIAL_SSTHRESH
+
+    @property
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    @property
+    def pacing_rate(self):
+        return None
+
+    def warm_start(self, cwnd, ssthresh):
+        self.cwnd = cwnd
+        self.ssthresh = ssthresh
+
+    @abstractmethod
+    def on_ack(self, acked, rtt=None, delivered=None):
+        pass
+
+    def on_dup_ack(self):
+        pass
+
+    @abstractmethod
+    def on_loss(self):
+        pass
+
+    def on_recovery_end(self):
+        pass
+
+    @abstractmethod
+    def on_timeout(self):
+        pass
+
+class Reno(CongestionControl):
+    '''
+    Slow start, +1 pkt per window of ACKs in congestion avoidance, halve on loss.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.__new_acks = 0                              # num of new acks, only used in congestion avoidance
+
+    def on_ack(self, acked, rtt=None, delivered=None):
+        if self.in_slow_start:
+            self.cwnd += acked
+            return
+        self.__new_acks += acked
+        if self.__new_acks >= self.cwnd:
+            self.cwnd += 1
+            self.__new_acks = 0
+
+    def on_dup_ack(self):
+        # window inflation
+        self.cwnd += 1
+
+    def on_loss(self):
+        self.ssthresh = max(self.cwnd // 2, 2)
+        self.cwnd = self.ssthresh + 3
+        self.__new_acks = 0
+
+    def on_recovery_end(self):
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        self.ssthresh = max(self.cwnd // 2, 2)
+        self.cwnd = 1
+        self.__new_acks = 0
+
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+class Cubic(CongestionControl):
+    '''
+    CUBIC (RFC 8312): after a loss the window follows W(t) = C(t - K)^3 + W_max,
+    which climbs back to W_max quickly, plateaus around it and then probes
+    beyond it, independent of the RTT. Never slower than Reno would be.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.__w_max = 0                                 # cwnd right before the last loss
+        self.__k = 0                                     # time for W(t) to get back to w_max
+        self.__epoch = None                              # start of the current congestion avoidance period
+        self.__w_est = 0                                 # the window Reno would have, the TCP-friendly region
+        self.__min_rtt = None
+
+    def on_ack(self, acked, rtt=None, delivered=None):
+        if rtt is not None:
+            self.__min_rtt = rtt if self.__min_rtt is None else min(self.__min_rtt, rtt)
+        if self.in_slow_start:
+            self.cwnd += acked
+            return
+
+        now = time.perf_counter()
+        if self.__epoch is None:
+            self.__epoch = now
+            if self.cwnd < self.__w_max:
+                self.__k = ((self.__w_max - self.cwnd) / CUBIC_C) ** (1 / 3)
+            else:
+                self.__k = 0
+                self.__w_max = self.cwnd
+            self.__w_est = self.cwnd
+        t = now - self.__epoch + (self.__min_rtt or 0)
+        target = CUBIC_C * (t - self.__k) ** 3 + self.__w_max
+        self.__w_est += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * acked / self.cwnd
+        target = max(target, self.__w_est)
+        if target > self.cwnd:
+            # at most 1.5x per RTT
+            self.cwnd += min(target - self.cwnd, self.cwnd / 2) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+
+    def __reduce(self):
+        self.__epoch = None
+        if self.cwnd < self.__w_max:
+            # fast convergence, release bandwidth to newer flows
+            self.__w_max = self.cwnd * (1 + CUBIC_BETA) / 2
+        else:
+            self.__w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * CUBIC_BETA, 2)
+
+    def on_loss(self):
+        self.__reduce()
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        self.__reduce()
+        self.cwnd = 1
+
+BBR_STARTUP_GAIN = 2.89     # 2/ln2, doubles the delivery rate every round
+BBR_CWND_GAIN = 2
+BBR_PROBE_GAINS = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+BBR_BW_ROUNDS = 10          # the bottleneck bandwidth is the max delivery rate over this many rounds
+BBR_MIN_RTT_WINDOW = 10     # seconds the min RTT estimate is kept
+BBR_MIN_CWND = 4
+BBR_LOSS_BETA = 0.7         # inflight cap after a loss, relative to cwnd
+
+class BBRMode(Enum):
+    STARTUP = 0
+    DRAIN = 1
+    PROBE_BW = 2
+
+class BBR(CongestionControl):
+    '''
+    A BBR-like model based controller. It keeps estimates of the bottleneck
+    bandwidth (max delivery rate over recent rounds) and of the propagation
+    delay (min RTT), paces at gain * bandwidth and caps the window at
+    BBR_CWND_GAIN * bandwidth * min RTT. Losses do not shrink the model but,
+    as in BBRv2, cap the window below the inflight that caused them, the cap
+    is raised again by a pkt per round when probing for more bandwidth.
+    A timeout restarts the window from one pkt.
+    Delivery rates are taken from `delivered`, so the jump of the cumulative
+    ACK after a hole is filled is not mistaken for a burst of bandwidth.
+    STARTUP grows like slow start until the bandwidth stops growing by 25% for
+    three rounds, DRAIN paces below the bandwidth for one round to empty the
+    queue built in STARTUP, then PROBE_BW cycles through BBR_PROBE_GAINS.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.ssthresh = float('inf')
+        self.mode = BBRMode.STARTUP
+        self.__delivered = 0                             # pkts acked or sacked so far
+        self.__inflight_hi = float('inf')                # cwnd cap after losses
+        self.__samples = deque()                         # (time, delivered) of recent ACKs, for delivery rates
+        self.__bw_samples = deque()                      # [round, max delivery rate in it], of the last rounds
+        self.__round = 0
+        self.__round_start = 0                           # delivered when the current round started
+        self.__full_bw = 0
+        self.__full_bw_rounds = 0
+        self.__min_rtt = None
+        self.__min_rtt_time = 0
+        self.__cycle = 0
+        self.__cycle_start = 0
+
+    @property
+    def in_slow_start(self):
+        return self.mode == BBRMode.STARTUP
+
+    @property
+    def bandwidth(self):
+        # pkts per second
+        return max((bw for _, bw in self.__bw_samples), default=0)
+
+    @property
+    def pacing_rate(self):
+        if self.bandwidth == 0:
+            return None
+        if self.mode == BBRMode.STARTUP:
+            return BBR_STARTUP_GAIN * self.bandwidth
+        if self.mode == BBRMode.DRAIN:
+            return self.bandwidth / BBR_STARTUP_GAIN
+        return BBR_PROBE_GAINS[self.__cycle] * self.bandwidth
+
+    def on_ack(self, acked, rtt=None, delivered=None):
+        now = time.perf_counter()
+        self.__delivered = max(self.__delivered + acked if delivered is None else delivered, self.__delivered)
+        if rtt is not None and (self.__min_rtt is None or rtt <= self.__min_rtt
+                                or now - self.__min_rtt_time > BBR_MIN_RTT_WINDOW):
+            self.__min_rtt = rtt
+            self.__min_rtt_time = now
+        self.__sample_bw(now)
+
+        if self.__min_rtt is None or self.bandwidth == 0:
+            # no model yet, grow like slow start
+            self.cwnd += acked
+            return
+        new_round = self.__delivered - self.__round_start >= max(self.cwnd, 1)
+        if new_round:
+            self.__round += 1
+            self.__round_start = self.__delivered
+            self.__update_state(now)
+
+        bdp = self.bandwidth * self.__min_rtt
+        gain = BBR_STARTUP_GAIN if self.mode == BBRMode.STARTUP else BBR_CWND_GAIN
+        target = max(min(gain * bdp, self.__inflight_hi), BBR_MIN_CWND)
+        if self.mode == BBRMode.STARTUP:
+            self.cwnd = max(self.cwnd, min(self.cwnd + acked, target))
+        else:
+            self.cwnd = min(self.cwnd + acked, target)
+
+    def __sample_bw(self, now):
+        # delivery rate over about the last min RTT
+        self.__samples.append((now, self.__delivered))
+        interval = self.__min_rtt or 0
+        while len(self.__samples) > 2 and now - self.__samples[1][0] >= interval:
+            self.__samples.popleft()
+        start, delivered = self.__samples[0]
+        if now - start <= 0 or now - start < interval:
+            return
+        rate = (self.__delivered - delivered) / (now - start)
+        if self.__bw_samples and self.__bw_samples[-1][0] == self.__round:
+            self.__bw_samples[-1][1] = max(self.__bw_samples[-1][1], rate)
+        else:
+            self.__bw_samples.append([self.__round, rate])
+        while self.__bw_samples[0][0] < self.__round - BBR_BW_ROUNDS:
+            self.__bw_samples.popleft()
+
+    def __update_state(self, now):
+        if self.mode == BBRMode.STARTUP:
+            if self.bandwidth >= 1.25 * self.__full_bw:
+                self.__full_bw = self.bandwidth
+                self.__full_bw_rounds = 0
+                return
+            self.__full_bw_rounds += 1
+            if self.__full_bw_rounds >= 3:
+                # the pipe is full
+                self.mode = BBRMode.DRAIN
+        elif self.mode == BBRMode.DRAIN:
+            self.mode = BBRMode.PROBE_BW
+            self.__cycle = 0
+            self.__cycle_start = now
+        else:
+            if BBR_PROBE_GAINS[self.__cycle] > 1:
+                self.__inflight_hi += 1
+            if now - self.__cycle_start >= self.__min_rtt:
+                self.__cycle = (self.__cycle + 1) % len(BBR_PROBE_GAINS)
+                self.__cycle_start = now
+
+    def warm_start(self, cwnd, ssthresh):
+        # the model is rebuilt, only the window is kept
+        self.cwnd = cwnd
+
+    def on_loss(self):
+        self.__inflight_hi = max(self.cwnd * BBR_LOSS_BETA, BBR_MIN_CWND)
+        self.cwnd = min(self.cwnd, self.__inflight_hi)
+        if self.mode == BBRMode.STARTUP:
+            # the pipe is full
+            self.mode = BBRMode.DRAIN
+
+    def on_timeout(self):
+        self.cwnd = 1
+
+CONGESTION_CONTROLS = {'reno': Reno, 'cubic': Cubic, 'bbr': BBR}
@@ -0,0 +1,63 @@
+import time
+from util.packet import MIN_PAYLOAD
+
+'''
+Discovery pkts carry a list of 20-byte chunkhashes, split into batches of
+HASHES_PER_PKT. Each batch goes in its own pkt with the batch index in the
+seq field and the num of batches in the ack field, a pkt with ack 0 is a
+round of its own.
+'''
+
+HASH_LEN = 20
+HASHES_PER_PKT = MIN_PAYLOAD // HASH_LEN    # WHOHAS and IHAVE pkts get through every path
+IHAVE_DELAY = 0.02          # max wait for the rest of a WHOHAS round before its IHAVEs are sent
+IHAVE_INTERVAL = 1          # a chunk is announced to the same peer at most once per this many seconds
+
+def batches(hashes):
+    '''
+    Payloads of the pkts carrying hashes, a list of digests.
+    '''
+    return [b''.join(hashes[i: i + HASHES_PER_PKT]) for i in range(0, len(hashes), HASHES_PER_PKT)]
+
+def split_hashes(payload):
+    return [bytes(payload[i: i + HASH_LEN]) for i in range(0, len(payload) - HASH_LEN + 1, HASH_LEN)]
+
+class IHaveBatcher():
+    '''
+    Responder side of discovery. The chunks we have out of every WHOHAS batch
+    of a peer are collected and announced in full IHAVE pkts once the last
+    batch of the round arrives, or IHAVE_DELAY after the latest one if it is
+    lost. A chunk already announced to the peer within IHAVE_INTERVAL is
+    left out, so peers flooding WHOHAS again and again get one answer.
+    '''
+    def __init__(self) -> None:
+        self.__pending = dict()                          # addr -> chunkhashes to announce, in WHOHAS order
+        self.__announced = dict()                        # addr -> {chunkhash: when it was announced}
+
+    def add(self, addr, hashes):
+        '''
+        Queue the chunks we have out of a WHOHAS batch from addr.
+        '''
+        now = time.time()
+        announced = self.__announced.get(addr, {})
+        pending = self.__pending.setdefault(addr, dict())
+        for chunkhash in hashes:
+            if now - announced.get(chunkhash, -IHAVE_INTERVAL) >= IHAVE_INTERVAL:
+                pending[chunkhash] = None
+
+    def take(self, addr):
+        '''
+        Payloads of the IHAVE pkts to send to addr now, the pending chunks count as announced.
+        '''
+        pending = self.__pending.pop(addr, None)
+        if not pending:
+            return []
+        now = time.time()
+        announced = {h: t for h, t in self.__announced.get(addr, {}).items() if now - t < IHAVE_INTERVAL}
+        announced.update(dict.fromkeys(pending, now))
+        self.__announced[addr] = announced
+        return batches(list(pending))
+
+    def waiting(self):
+        # peers with chunks still to announce
+        return list(self.__pending)
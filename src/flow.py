@@ -0,0 +1,42 @@
+import time
+from util.packet import CHUNK_DATA_SIZE
+
+MAX_FLOWS_PER_PEER = 4
+QUICK_ACKS = 16              # ACK every pkt at the start of a flow and after a loss
+INITIAL_RTO = 1              # RTO of a flow before its first DATA, as in RFC 6298
+
+class Flow():
+    '''
+    Download side state of a chunk transfer, identified by (sender addr, flow id).
+    The flow id is chosen by the downloader and carried in the seq field of GET,
+    the sender echoes it in the ack field of DATA pkts and ACKs carry it in their
+    seq field, so several chunks can move between the same pair of peers.
+    rto estimates the sender's retransmission timeout from the round trip of GET,
+    a flow with no new DATA for a few of them is considered stalled.
+    '''
+    __slots__ = ('addr', 'flow_id', 'chunkhash_str', 'payload_size', 'probe', 'pending_acks', 'quick_acks',
+                 'get_time', 'rto')
+
+    def __init__(self, addr, flow_id, chunkhash_str, payload_size, probe=False) -> None:
+        self.addr = addr                                 # sender's address, (ip, port)
+        self.flow_id = flow_id
+        self.chunkhash_str = chunkhash_str               # the chunk downloaded in this flow
+        self.payload_size = payload_size                 # DATA payload asked for in GET
+        self.probe = probe                               # probing payload_size, until the first DATA arrives
+        self.pending_acks = 0                            # in-order pkts received but not acked yet, see --delayed-ack
+        self.quick_acks = QUICK_ACKS                     # in-order pkts still acked at once, the sender's cwnd is small
+        self.get_time = time.perf_counter()              # when GET was sent, None once DATA has arrived
+        self.rto = INITIAL_RTO
+
+    @property
+    def key(self):
+        return (self.addr, self.flow_id)
+
+    @property
+    def num_pkts(self):
+        return (CHUNK_DATA_SIZE + self.payload_size - 1) // self.payload_size
+
+    def on_first_data(self):
+        # srtt + 4 * rttvar of a first RTT sample, as in RFC 6298
+        self.rto = 3 * (time.perf_counter() - self.get_time)
+        self.get_time = None
@@ -0,0 +1,72 @@
+import os
+import hashlib
+
+class DownloadJournal():
+    '''
+    Progress of a DOWNLOAD, kept next to the output file so that a restarted
+    peer asked for the same target only fetches what is missing.
+    The chunk data itself lives in the spool file of the ChunkWriter, the
+    journal is an append-only text file of records about it:
+        J <digest of the chunkhash list>    header, the target the journal is for
+        C <chunkhash>                       the chunk is complete in its spool slot
+        P <chunkhash> <payload> <pkts>      the first pkts of the chunk are in its spool slot
+    Records are buffered and appended in batches by sync(), which must only
+    be called once the data they describe has been flushed, so a record on
+    disk never points to data that is not. A torn last line is ignored.
+    With resume=False, e.g. when the spool file is gone, an existing journal is discarded.
+    '''
+    def __init__(self, path, chunkhash_strs, resume=True) -> None:
+        self.path = path
+        self.completed = set()                           # chunks complete in the spool
+        self.partial = dict()                            # hashstr -> (payload size, pkts in order) in the spool
+        self.__pending = []                              # records not written yet
+        header = 'J ' + hashlib.sha1(' '.join(chunkhash_strs).encode()).hexdigest()
+        self.resumed = resume and self.__replay(header)  # whether progress was found for this target
+        if not self.resumed:
+            self.completed.clear()
+            self.partial.clear()
+        self.__file = open(path, 'a' if self.resumed else 'w')
+        if not self.resumed:
+            self.__pending.append(header)
+            self.sync()
+
+    def __replay(self, header):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as jf:
+            lines = jf.read().split('\n')
+        # the last element is empty unless the last line is torn
+        if len(lines) < 2 or lines[0] != header:
+            return False
+        for line in lines[1:-1]:
+            record = line.split(' ')
+            if record[0] == 'C' and len(record) == 2:
+                self.completed.add(record[1])
+                self.partial.pop(record[1], None)
+            elif record[0] == 'P' and len(record) == 4:
+                self.partial[record[1]] = (int(record[2]), int(record[3]))
+        return True
+
+    def complete(self, chunkhash_str):
+        self.completed.add(chunkhash_str)
+        self.partial.pop(chunkhash_str, None)
+        self.__pending.append(f'C {chunkhash_str}')
+
+    def progress(self, chunkhash_str, payload_size, pkts):
+        self.partial[chunkhash_str] = (payload_size, pkts)
+        self.__pending.append(f'P {chunkhash_str} {payload_size} {pkts}')
+
+    def sync(self):
+        '''
+        Append the buffered records and fsync.
+        '''
+        if not self.__pending:
+            return
+        self.__file.write('\n'.join(self.__pending) + '\n')
+        self.__pending.clear()
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def remove(self):
+        self.__file.close()
+        os.remove(self.path)
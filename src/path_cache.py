@@ -0,0 +1,41 @@
+import time
+
+PATH_MAX_AGE = 60           # seconds an estimate is trusted after its last update
+
+class PathEstimate():
+    __slots__ = ('srtt', 'rttvar', 'min_rtt', 'cwnd', 'ssthresh', 'updated')
+
+    def __init__(self, srtt, rttvar, min_rtt, cwnd, ssthresh) -> None:
+        self.srtt = srtt                                 # smoothed RTT
+        self.rttvar = rttvar                             # RTT deviation
+        self.min_rtt = min_rtt
+        self.cwnd = cwnd                                 # cwnd of the last flow to the peer
+        self.ssthresh = ssthresh
+        self.updated = time.time()
+
+class PathCache():
+    '''
+    RTT estimates and congestion state of the last finished flow to every peer
+    we send to, kept across flows so that a new FSM to a known peer starts with the right timeout
+    and window instead of learning them again. Estimates not updated for max_age
+    seconds are dropped.
+    '''
+    def __init__(self, max_age=PATH_MAX_AGE) -> None:
+        self.max_age = max_age
+        self.__estimates = dict()                        # addr -> PathEstimate
+
+    def get(self, addr):
+        est = self.__estimates.get(addr)
+        if est is not None and time.time() - est.updated > self.max_age:
+            self.__estimates.pop(addr)
+            return None
+        return est
+
+    def update(self, addr, srtt, rttvar, min_rtt, cwnd, ssthresh):
+        # re-inserting keeps the dict ordered by update time
+        self.__estimates.pop(addr, None)
+        self.__estimates[addr] = PathEstimate(srtt, rttvar, min_rtt, cwnd, ssthresh)
+        if len(self.__estimates) > 1 and time.time() - next(iter(self.__estimates.values())).updated > self.max_age:
+            # the oldest entry is stale, sweep
+            now = time.time()
+            self.__estimates = {a: e for a, e in self.__estimates.items() if now - e.updated <= self.max_age}
@@ -3,54 +3,83 @@ import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import select
+import asyncio
 import util.simsocket as simsocket
+from util.recv_ring import RecvRing
 import struct
-import socket
 import util.bt_utils as bt_utils
-import hashlib
 import argparse
-import pickle
 import logging
 import time
+import hashlib
 from matplotlib import pyplot as plt
 from collections import defaultdict
-from FSM import FSM, State, Event
+from FSM import FSM, State
+from congestion import CONGESTION_CONTROLS
+from path_cache import PathCache
+from reassembly import ChunkBuffer
+from flow import Flow, MAX_FLOWS_PER_PEER, QUICK_ACKS
+from timer_heap import TimerHeap, LoopTimers
+from pmtu import PathMTU, PROBE_TIMEOUT
+from chunk_writer import ChunkWriter
+from journal import DownloadJournal
+from discovery import IHaveBatcher, IHAVE_DELAY, batches, split_hashes
+from util.merkle import merkle_tree
+from util.packet import (WHOHAS, IHAVE, GET, DATA, ACK, DENIED, HEADER_LEN, MAX_PKT_SIZE,
+                         MIN_PAYLOAD, unpack_header, make_packet, pack_sack, unpack_sack, DataPacketCache)
 
 """
 This is CS305 project skeleton code.
 Please refer to the example files - example/dumpreceiver.py and example/dumpsender.py - to learn how to play with this skeleton.
 """
 
-MAX_PAYLOAD = 1024
-CHUNK_DATA_SIZE = 512 * 1024
-BUF_SIZE = 1400
-HEADER_LEN = struct.calcsize("HBBHHII")
+BUF_SIZE = MAX_PKT_SIZE
 HASH_LEN = 20
+MAX_MERKLE_TREES = 64
+MAX_FINISHED_FLOWS = 64
 
-WHOHAS = 0
-IHAVE = 1
-GET = 2
-DATA = 3
-ACK = 4
-DENIED = 5
+# GET options, one byte after the chunkhash, followed by the payload size and the start seq
+GET_MERKLE = 1  # ask for a merkle proof in every DATA pkt
 
-# Code2Type = ['WHOHAS', 'IHAVE', 'GET', 'DATA', 'ACK', 'DENIED']
+# what a DENIED is about, in its ack field, with the flow id in the seq field
+DENIED_PAYLOAD = 1  # a GET asked for a payload size that does not fit in a pkt
+DENIED_RANGE = 2    # a ranged GET started past the end of the chunk
+DENIED_FLOW = 3     # the receiver gives up a flow, e.g. it has stalled or its probe failed
+DENIED_BUSY = 4     # the holder is already sending <max send> flows
 
-TEAM = 29
-MAGIC = 52305
+# Code2Type = ['WHOHAS', 'IHAVE', 'GET', 'DATA', 'ACK', 'DENIED']
 
 finished = dict()
 ex_output_file = None
-ex_downloading_chunkhash = ""
-received_chunks = dict()    # hashstr to data
-peer_chunkhash_str = dict() # ip to hashstr
-ex_sending_chunkhash = ''
-peer_fsm = dict()
-num_concurrent_send = 0
+chunk_writer = None         # ChunkWriter of the current DOWNLOAD
+journal = None              # DownloadJournal of the current DOWNLOAD, if --journal-sync is set
+received_chunks = dict()    # hashstr to ChunkBuffer, only chunks being downloaded
+download_flows = dict()     # (sender addr, flow id) to Flow
+finished_flows = dict()     # (sender addr, flow id) to num of pkts of recently completed flows, at most MAX_FINISHED_FLOWS
+chunk_flows = dict()        # hashstr to the Flow downloading it, partial chunks without one are resumed by ranged GETs
+next_flow_id = 1
+chunk_holders = defaultdict(set)    # hashstr to peers that replied IHAVE for it
+bad_holders = set()         # (peer, hashstr) of chunks a peer has sent us failing their sha1 check
+merkle_trees = dict()       # chunkhash to merkle tree of chunks we are sending, at most MAX_MERKLE_TREES
+ihave_batcher = IHaveBatcher()  # IHAVEs waiting for the rest of a WHOHAS round
+peer_fsm = dict()           # (receiver addr, flow id) to FSM of the chunk being sent
+timers = TimerHeap()        # retransmission deadlines of peer_fsm, same keys
+pkt_cache = None            # DataPacketCache shared by all FSMs, if --pkt-cache is set
+path_mtu = PathMTU(MIN_PAYLOAD)     # payload size search per sender, up to --max-payload
+path_cache = PathCache()    # RTT estimates of peers we send to, across FSMs
+num_concurrent_send = 0     # num of FSMs in peer_fsm
+evicted_flows = 0           # sending flows dropped as their receiver stopped answering
 last_get_data_time = None
-
-# peer 和 seq 对应关系 其中key是peer的地址，value是上一次的seq
-peer_seq = dict()
+# select waits at most this long, so that window sizes are sampled and stalled downloads restarted
+MAX_SELECT_WAIT = 0.1
+RESTART_TIMEOUT = 5         # restart the download if no DATA arrives for this long
+STALL_RTOS = 2              # a flow is stalled after this many of its RTOs without new DATA
+BUSY_RETRY = 1              # seconds before a chunk all of whose holders are busy is asked for again
+ACK_DELAY = 0.01            # max time an in-order pkt waits for its ACK with --delayed-ack, below the RTT
+# 统计window size 和此时的时间
+window_size = defaultdict(list)
+time_window_size = defaultdict(list)
+next_sample = 0
 
 # to restart the download to avoid some peers dead
 LAST_COMMAND = ''
@@ -62,22 +91,35 @@ def process_download(sock, chunkfile, outputfile):
     # print('PROCESS DOWNLOAD SKELETON CODE CALLED.  Fill me in!')
     global ex_output_file
     global received_chunks
-    global ex_downloading_chunkhash
     global finished
+    global chunk_writer
+    global journal
 
     ex_output_file = outputfile
     download_hash = bytes()  # list of chunkhashes
     with open(chunkfile, 'r') as cf:
-        chunkhash_strs = map(lambda line: line.strip().split(" ")[1], cf.readlines())
+        chunkhash_strs = list(map(lambda line: line.strip().split(" ")[1], cf.readlines()))
+    chunk_writer = ChunkWriter(outputfile, [h for h in chunkhash_strs if h not in config.haschunks],
+                               resume=config.journal_sync > 0)
 
     # TODO: send WHOHAS packet
     # TODO: remove already had chunks from requested chunks
     for chunkhash_str in chunkhash_strs:
         if chunkhash_str not in config.haschunks:
+            finished[chunkhash_str] = False
+    if config.journal_sync > 0:
+        journal = DownloadJournal(outputfile + '.journal', list(chunk_writer.index), resume=chunk_writer.resumed)
+        timers.schedule(journal, time.perf_counter() + config.journal_sync)
+        if journal.resumed:
+            resume_download()
+            if all(finished.values()):
+                finish_download()
+                return
+    for chunkhash_str, if_finish in finished.items():
+        if not if_finish:
             # hex_str to bytes
             chunkhash = bytes.fromhex(chunkhash_str)
             download_hash += chunkhash
-            finished[chunkhash_str] = False
 
     # Step2: make WHOHAS pkt
     # |2byte magic|1byte team |1byte type|
@@ -85,82 +127,76 @@ def process_download(sock, chunkfile, outputfile):
     # |      4byte  seq                  |
     # |      4byte  ack                  |
 
-    # struct format
-    # H -> unsigned short 2 bytes
-    # B -> unsigned char  1 byte
-    # I -> unsigned int   4 bytes
-
-    # socket.htons(), socket.htonl(): convert from host byte order to network byte order
-    # h -> host, n -> network, s -> short, l -> long 
+    # util/packet.py packs the header in network byte order
     if len(download_hash) > 0:
-        whohas_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, WHOHAS, socket.htons(HEADER_LEN),
-                                    socket.htons(HEADER_LEN + len(download_hash)), socket.htonl(0), socket.htonl(0))
-        whohas_pkt = whohas_header + download_hash
-
         # Step3: flooding whohas to all peers in peer list
-        peer_list = config.peers
-        for p in peer_list:  # nodeid, hostname, port
-            if int(p[0]) != config.identity:
-                sock.sendto(whohas_pkt, (p[1], int(p[2])))
+        flood_whohas(sock, download_hash)
 
 def process_inbound_udp(sock):
+    # Receive pkt, a view of the socket's buffer valid until the next recv
+    pkt, from_addr = sock.recvfrom_view(BUF_SIZE)
+    process_pkt(sock, pkt, from_addr)
+
+def process_inbound_batch(sock):
+    """
+    drain up to config.batch queued pkts with a non-blocking socket
+    """
+    for pkt, from_addr in sock.recv_batch(BUF_SIZE, config.batch):
+        process_pkt(sock, pkt, from_addr)
+
+def process_inbound_ring(sock, ring):
+    """
+    take up to config.batch pkts read by the receive thread
+    """
+    for pkt, from_addr in ring.get_batch(config.batch):
+        process_pkt(sock, pkt, from_addr)
+
+def process_pkt(sock, pkt, from_addr):
     global num_concurrent_send
     global received_chunks
-    global peer_chunkhash_str
-    global ex_sending_chunkhash
     global peer_fsm
     global finished
     global last_get_data_time
-    # Receive pkt
-    pkt, from_addr = sock.recvfrom(BUF_SIZE)
-    Magic, Team, Type, hlen, plen, Seq, Ack = struct.unpack("HBBHHII", pkt[:HEADER_LEN])
-    data = pkt[HEADER_LEN:]
+    Magic, Team, Type, hlen, plen, Seq, Ack = unpack_header(pkt)
+    # header extension, e.g. the merkle proof of DATA pkts
+    ext = pkt[HEADER_LEN:hlen]
+    data = pkt[hlen:]
     # logger.info(f'received {Code2Type[Type]} pkt from {from_addr}, data: {bytes.hex(data) if Type != DATA else ""}')
 
     if Type == WHOHAS:
         # TODO: send IHAVE packet
         # TODO: control number of concurrent send
 
-        # already sending to <max send> peers
-        if num_concurrent_send == config.max_conn:
+        # already sending to <max send> peers, answered once per WHOHAS round
+        if num_concurrent_send >= config.max_conn and Seq == 0:
             # send DENIED packet
-            denied_pkt = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, DENIED, socket.htons(HEADER_LEN),
-                                     socket.htons(HEADER_LEN), socket.htonl(0), socket.htonl(0))
+            denied_pkt = make_packet(DENIED)
             sock.sendto(denied_pkt, from_addr)
             logger.info(f'sent DENIED pkt to {from_addr}')
             pass
 
-        # see what chunk the sender has
-        whohas_chunk_hashes = [data[i:i + HASH_LEN] for i in range(0, len(data), HASH_LEN)]
-
-        logger.info(f'received WHOHAS pkt from {from_addr}, whohas: {map(bytes.hex, whohas_chunk_hashes)}')
+        # see what chunk the sender has, batch Seq of Ack
+        whohas_chunk_hashes = split_hashes(data)
 
-        # bytes to hex_str
-        has_hash = bytes()
-        chunkhash_strs = []  # debug
-        for chunk_hash in whohas_chunk_hashes:
-            chunkhash_str = bytes.hex(chunk_hash)
-            chunkhash_strs.append(chunkhash_str)  # debug
-            if chunkhash_str in config.haschunks:
-                has_hash += chunk_hash
+        logger.info(f'received WHOHAS pkt from {from_addr}, whohas: {len(whohas_chunk_hashes)} chunks, '
+                    f'batch: {Seq}/{Ack}')
 
-        ex_sending_chunkhash = chunkhash_str
+        # look up raw digests, no hex str needed
+        has_hashes = [chunk_hash for chunk_hash in whohas_chunk_hashes if chunk_hash in config.haschunks]
+        ihave_batcher.add(from_addr, has_hashes)
 
-        logger.info(f"whohas: {chunkhash_strs}, has: {list(config.haschunks.keys())}")  # debug
         # if chunkhash_str in config.haschunks:
-        # send back IHAVE pkt
-        if len(has_hash) > 0:
-            ihave_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, IHAVE, socket.htons(HEADER_LEN),
-                                       socket.htons(HEADER_LEN + len(has_hash)), socket.htonl(0), socket.htonl(0))
-            ihave_pkt = ihave_header + has_hash
-            sock.sendto(ihave_pkt, from_addr)
-            logger.info(f'sent IHAVE pkt to {from_addr}, data: {bytes.hex(has_hash)}')
+        # send back IHAVE pkts once the whole round is in
+        if Seq + 1 >= Ack:
+            send_ihave(sock, from_addr)
+        else:
+            timers.schedule(ihave_batcher, time.perf_counter() + IHAVE_DELAY)
 
     elif Type == IHAVE:
-        # see what chunk the sender has
-        has_chunkhashes = [data[i:i + HASH_LEN] for i in range(0, len(data), HASH_LEN)]
+        # see what chunk the sender has, batches of a round are merged into chunk_holders as they come
+        has_chunkhashes = split_hashes(data)
 
-        logger.info(f'received IHAVE pkt from {from_addr}, ihave: {map(bytes.hex, has_chunkhashes)}')
+        logger.info(f'received IHAVE pkt from {from_addr}, ihave: {len(has_chunkhashes)} chunks, batch: {Seq}/{Ack}')
 
         # TODO: send back GET pkt
         # TODO: design a policy to determine request which chunk from which peer
@@ -168,127 +204,460 @@ def process_inbound_udp(sock):
         # if no unrequested chunk, just pass
         # check if there're still unrequested chunks when finished receiving a chunk from a peer
         # if yes, request it
+        for has_chunkhash in has_chunkhashes:
+            chunk_holders[bytes.hex(has_chunkhash)].add(from_addr)
+        # several chunks can be requested from a peer, each in its own flow
+        num_flows = count_flows(from_addr)
         for has_chunkhash in has_chunkhashes:
             has_chunkhash_str = bytes.hex(has_chunkhash)
             
-            if has_chunkhash_str not in received_chunks:
-                peer_chunkhash_str[from_addr] = has_chunkhash_str
-                received_chunks[has_chunkhash_str] = bytes()
-                get_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, GET, socket.htons(HEADER_LEN),
-                                         socket.htons(HEADER_LEN + len(has_chunkhash)), socket.htonl(0),
-                                         socket.htonl(0))
-                get_pkt = get_header + has_chunkhash
-                sock.sendto(get_pkt, from_addr)
-                logger.info(f'sent GET pkt to {from_addr}, data: {has_chunkhash_str}')
+            if num_flows >= MAX_FLOWS_PER_PEER:
                 break
+            if finished.get(has_chunkhash_str) is not False or has_chunkhash_str in chunk_flows:
+                continue
+            if avoid_holder(from_addr, has_chunkhash_str):
+                continue
+            if has_chunkhash_str not in received_chunks:
+                if len(received_chunks) >= config.max_buffers:
+                    # too many chunks in progress, it will be requested when one finishes
+                    continue
+                received_chunks[has_chunkhash_str] = new_chunk_buffer(has_chunkhash_str)
+            # a partial chunk whose flow stalled resumes where it stopped
+            send_get(sock, has_chunkhash_str, from_addr)
+            num_flows += 1
 
     elif Type == GET:
         # TODO: deal with GET
 
-        logger.info(f'received GET pkt from {from_addr}, get: {bytes.hex(data)}')
-
+        # |20byte chunkhash|1byte options|2byte payload size|4byte start seq|, the flow id is in the seq field
+        chunkhash = bytes(data[:HASH_LEN])
+        options = data[HASH_LEN] if len(data) > HASH_LEN else 0
+        payload_size = struct.unpack_from("!H", data, HASH_LEN + 1)[0] if len(data) >= HASH_LEN + 3 else MIN_PAYLOAD
+        start_seq = struct.unpack_from("!I", data, HASH_LEN + 3)[0] if len(data) >= HASH_LEN + 7 else 0
+        chunkhash_str = bytes.hex(chunkhash)
+        flow_key = (from_addr, Seq)
+        logger.info(f'received GET pkt from {from_addr}, get: {chunkhash_str}, flow: {flow_key[1]}, '
+                    f'options: {options}, payload: {payload_size}, start: {start_seq}')
+
+        # zero-copy view of the chunk in the chunk store
+        chunkdata = config.haschunks[chunkhash]
+
+        tree = None
+        if options & GET_MERKLE and payload_size > 0:
+            tree_key = (chunkhash, payload_size)
+            if tree_key not in merkle_trees:
+                if len(merkle_trees) >= MAX_MERKLE_TREES:
+                    merkle_trees.pop(next(iter(merkle_trees)))
+                merkle_trees[tree_key] = merkle_tree(chunkdata, payload_size)
+            tree = merkle_trees[tree_key]
+        # the proof is the root and a sibling per level
+        ext_len = HASH_LEN * len(tree) if tree else 0
+        if not 0 < payload_size <= MAX_PKT_SIZE - HEADER_LEN - ext_len:
+            sock.sendto(make_packet(DENIED, seq=flow_key[1], ack=DENIED_PAYLOAD), from_addr)
+            logger.warning(f'sent DENIED pkt to {from_addr}, payload {payload_size} does not fit in a pkt')
+            return
+        if start_seq * payload_size >= len(chunkdata):
+            sock.sendto(make_packet(DENIED, seq=flow_key[1], ack=DENIED_RANGE), from_addr)
+            logger.warning(f'sent DENIED pkt to {from_addr}, start {start_seq} is past the chunk')
+            return
+
+        if flow_key not in peer_fsm and num_concurrent_send >= config.max_conn:
+            # already sending <max send> flows
+            sock.sendto(make_packet(DENIED, seq=flow_key[1], ack=DENIED_BUSY), from_addr)
+            logger.info(f'sent DENIED pkt to {from_addr}, already sending {num_concurrent_send} flows')
+            return
+
+        if flow_key in peer_fsm:
+            # the same GET again, start over
+            release_fsm(flow_key)
         # increment concurrent send number
         num_concurrent_send += 1
-        chunkhash_str = bytes.hex(data)
-        chunkdata = config.haschunks[chunkhash_str]
 
-        # initialize peer's FSM
-        peer_fsm[from_addr] = FSM(from_addr, chunkhash_str, chunkdata, config.timeout, logger)
+        # initialize the flow's FSM
+        peer_fsm[flow_key] = FSM(from_addr, chunkhash_str, chunkdata, config.timeout, logger,
+                                 selective_repeat=config.selective_repeat, merkle_tree=tree, flow_id=flow_key[1],
+                                 timers=timers, pkt_cache=pkt_cache, payload_size=payload_size,
+                                 cc=CONGESTION_CONTROLS[config.cc](), pacing=config.pacing,
+                                 path_cache=path_cache, rto_min=config.rto_min, rto_max=config.rto_max,
+                                 ttl=config.send_ttl, start_seq=start_seq)
 
         # send first pkt
-        peer_fsm[from_addr].transit(sock, 0)
+        peer_fsm[flow_key].transit(sock, start_seq)
 
         # send back DATA
         # pkt_data = chunkdata[:MAX_PAYLOAD]
-        # data_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, DATA, socket.htons(HEADER_LEN),
-        #                           socket.htons(HEADER_LEN + len(pkt_data)), socket.htonl(1), 0)
-        # sock.sendto(data_header + pkt_data, from_addr)
+        # sock.sendto(make_packet(DATA, pkt_data, seq=1), from_addr)
         # logger.info(f'sent DATA pkt to {from_addr}, seq: 1')
 
     elif Type == DATA:
         # TODO: receive DATA packet
         # TODO: distinguish packets to corresponding chunks
-        # 如果没有有这个peer，就添加到peer_seq字典中
-        Seq = socket.ntohl(Seq)
-        if from_addr not in peer_seq:
-            peer_seq[from_addr] = Seq
-            received_chunks[peer_chunkhash_str[from_addr]] += data
-            # send back ACK
-            ack_pkt = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, ACK, socket.htons(HEADER_LEN),
-                                  socket.htons(HEADER_LEN), 0, socket.htonl(Seq))
-            sock.sendto(ack_pkt, from_addr)
-            logger.info(f'sent ACK pkt to {from_addr}, ACK: {Seq}')
-        # 如果有这个peer，就判断seq是否是期望的
-        else:
-            last_received_seq = peer_seq[from_addr]
-            if Seq == last_received_seq + 1:
-                peer_seq[from_addr] = Seq
-                received_chunks[peer_chunkhash_str[from_addr]] += data
-
-                last_get_data_time = time.time()
-
-                # send back ACK
-                ack_pkt = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, ACK, socket.htons(HEADER_LEN),
-                                        socket.htons(HEADER_LEN), 0, socket.htonl(Seq))
-                sock.sendto(ack_pkt, from_addr)
-                logger.info(f'recv seq: {Seq}, sent ACK pkt to {from_addr}, ACK: {Seq}')
+        # the flow id is in the ack field
+        flow = download_flows.get((from_addr, Ack))
+        if flow is None:
+            if (from_addr, Ack) in finished_flows:
+                # the sender of a completed chunk missed our last ACK
+                sock.sendto(make_packet(ACK, seq=Ack, ack=finished_flows[(from_addr, Ack)]), from_addr)
             else:
-                # send back ACK
-                ack_pkt = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, ACK, socket.htons(HEADER_LEN),
-                                        socket.htons(HEADER_LEN), 0, socket.htonl(last_received_seq))
-                sock.sendto(ack_pkt, from_addr)
-                # sock.sendto(ack_pkt, from_addr)
-                # sock.sendto(ack_pkt, from_addr)
-                logger.info(f'recv seq: {Seq}, sent ACK pkts to {from_addr}, ACK: {last_received_seq}')     
+                # DATA of a flow we have dropped, or of one from before a restart,
+                # the sender may have missed our DENIED and still hold its upload slot
+                sock.sendto(make_packet(DENIED, seq=Ack, ack=DENIED_FLOW), from_addr)
+            return
+        if plen != len(pkt):
+            # cut short on the way, the payload size is too large for the path
+            logger.warning(f'truncated DATA pkt {Seq} from {from_addr}, {len(pkt)} of {plen} bytes')
+            if flow.probe:
+                probe_failed(sock, flow)
+            return
+        if flow.probe:
+            # the first DATA of a probing flow, the path takes its payload size
+            flow.probe = False
+            timers.cancel(flow)
+            path_mtu.confirm(flow.addr, flow.payload_size)
+            logger.info(f'payload {flow.payload_size} confirmed from {from_addr}')
+        if flow.get_time is not None:
+            flow.on_first_data()
+        chunkhash_str = flow.chunkhash_str
+        if chunkhash_str not in received_chunks:
+            if finished.get(chunkhash_str):
+                # the sender missed our last ACK
+                send_ack(sock, flow, flow.num_pkts)
+            return
+        chunk_buf = received_chunks[chunkhash_str]
+        if len(ext) > 0 and not chunk_buf.verify_piece(Seq, data, ext):
+            # corrupted piece, drop it so that only this pkt is sent again
+            logger.warning(f'DATA pkt {Seq} of {chunkhash_str} from {from_addr} fails merkle check')
+            send_ack(sock, flow, chunk_buf.last_in_order, chunk_buf.sack_ranges())
+            return
+        # out-of-order pkts are buffered too, the bitmap in chunk_buf tells what is missing
+        in_order = Seq == chunk_buf.last_in_order + 1 and not chunk_buf.has_gaps
+        if chunk_buf.write(Seq, data):
+            last_get_data_time = time.time()
+            if chunk_flows.get(chunkhash_str) is flow:
+                timers.schedule(chunkhash_str, time.perf_counter() + stall_timeout(flow))
+        else:
+            in_order = False
+
+        if in_order and flow.quick_acks > 0:
+            flow.quick_acks -= 1
+            send_ack(sock, flow, chunk_buf.last_in_order)
+        elif in_order and not chunk_buf.complete and config.delayed_ack > 1:
+            # delayed ACK, every config.delayed_ack in-order pkts or after ACK_DELAY
+            flow.pending_acks += 1
+            if flow.pending_acks >= config.delayed_ack:
+                send_ack(sock, flow, chunk_buf.last_in_order)
+            elif flow.pending_acks == 1:
+                timers.schedule(flow, time.perf_counter() + ACK_DELAY)
+        else:
+            if not in_order:
+                # out-of-order, filling a hole or duplicate, ACK right away so that the sender
+                # can fast retransmit, and ACK every pkt for a while as its cwnd has shrunk
+                flow.quick_acks = QUICK_ACKS
+            # send back cumulative ACK, with SACK blocks of buffered out-of-order pkts
+            send_ack(sock, flow, chunk_buf.last_in_order, chunk_buf.sack_ranges())
+        logger.info(f'recv seq: {Seq}')
 
         # see if finished
         # TODO: request unrequested chunks when finish receiving a chunk
-        if len(received_chunks[peer_chunkhash_str[from_addr]]) == CHUNK_DATA_SIZE:
+        if chunk_buf.complete and not finished.get(chunkhash_str, False):
+            if not chunk_buf.verify():
+                # corrupted or mismatched chunk, drop it and ask another holder right away
+                logger.warning(f'chunk {chunkhash_str} from {from_addr} fails sha1 check, re-requesting')
+                bad_holders.add((from_addr, chunkhash_str))
+                drop_flow(flow)
+                chunk_buf.reset()
+                rerequest_chunk(sock, chunkhash_str)
+                return
+
             # finished downloading this chunkdata!
-            finished[peer_chunkhash_str[from_addr]] = True
+            # stream it to the output file and release its buffer
+            finished[chunkhash_str] = True
+            chunk_writer.write(chunkhash_str, chunk_buf.getbuffer())
+            if journal is not None:
+                journal.complete(chunkhash_str)
+            received_chunks.pop(chunkhash_str)
+            retire_flow(chunk_flows.get(chunkhash_str, flow))
+            retire_flow(flow)
+            # add to this peer's haschunk:
+            config.haschunks[chunk_buf.chunkhash] = chunk_writer.read(chunkhash_str)
+            logger.info(f"received chunk {chunkhash_str} from {from_addr}")
 
             # see if finished downloading all chunks
             if all(finished.values()):
-                # dump your received chunk to file in dict form using pickle
-                with open(ex_output_file, "wb") as wf:
-                    pickle.dump(received_chunks, wf)
-
-                # add to this peer's haschunk:
-                config.haschunks[ex_downloading_chunkhash] = received_chunks[ex_downloading_chunkhash]
-
-                # you need to print "GOT" when finished downloading all chunks in a DOWNLOAD file
-                logger.info(f"GOT {ex_output_file}")
-
-                # The following things are just for illustration, you do not need to print out in your design.
-                sha1 = hashlib.sha1()
-                sha1.update(received_chunks[ex_downloading_chunkhash])
-                received_chunkhash_str = sha1.hexdigest()
-                logger.info(f"Expected chunkhash: {ex_downloading_chunkhash}")
-                logger.info(f"Received chunkhash: {received_chunkhash_str}")
-                success = ex_downloading_chunkhash == received_chunkhash_str
-                logger.info(f"Successful received: {success}")
-                if success:
-                    logger.info("Congrats! You have completed the example!")
-                else:
-                    logger.info("Example fails. Please check the example files carefully.")
-
-                # decrement concurrent send number 
-                num_concurrent_send -= 1
+                finish_download()
+            else:
+                request_next_chunk(sock, from_addr)
 
     elif Type == ACK:
         # TODO: deal with ACK
         # received an ACK pkt
-        ack_num = socket.ntohl(Ack)
-        logger.info(f'received ACK pkt from {from_addr}, ACK num: {ack_num}')
-        
-        peer_fsm[from_addr].transit(sock, ack_num)
-        if peer_fsm[from_addr].state == State.FINISHED:
+        # the flow id is in the seq field
+        ack_num = Ack
+        flow_key = (from_addr, Seq)
+        # SACK blocks from the ACK payload, empty if the receiver does not send them
+        sack_ranges = unpack_sack(data)
+        logger.info(f'received ACK pkt from {from_addr}, flow: {flow_key[1]}, ACK num: {ack_num}, SACK: {sack_ranges}')
+
+        if flow_key not in peer_fsm:
+            # late ACK of a finished chunk
+            return
+        peer_fsm[flow_key].transit(sock, ack_num, sack_ranges)
+        if peer_fsm[flow_key].state == State.FINISHED:
             # finished sending the chunk, remove the fsm
-            peer_fsm.pop(from_addr)
+            release_fsm(flow_key)
 
     elif Type == DENIED:
         # TODO: deal with DENIED
-        pass
+        # the flow id is in the seq field, DENIEDs of WHOHAS carry none
+        flow_key = (from_addr, Seq)
+        if Ack == DENIED_FLOW and flow_key in peer_fsm:
+            # a receiver gives up a flow
+            logger.info(f'flow {flow_key} cancelled by the receiver')
+            release_fsm(flow_key)
+        elif Ack in (DENIED_PAYLOAD, DENIED_RANGE, DENIED_BUSY) and flow_key in download_flows:
+            get_denied(sock, download_flows[flow_key], Ack)
+
+def send_ack(sock, flow, ack_num, sack_ranges=()):
+    # the flow id goes in the seq field and SACK blocks go in the payload
+    if flow.pending_acks > 0:
+        # covers the delayed ones
+        flow.pending_acks = 0
+        timers.cancel(flow)
+    ack_pkt = make_packet(ACK, pack_sack(sack_ranges), seq=flow.flow_id, ack=ack_num)
+    sock.sendto(ack_pkt, flow.addr)
+    logger.info(f'sent ACK pkt to {flow.addr}, flow: {flow.flow_id}, ACK: {ack_num}, SACK: {sack_ranges}')
+
+def send_delayed_ack(sock, flow):
+    if download_flows.get(flow.key) is flow and flow.chunkhash_str in received_chunks:
+        chunk_buf = received_chunks[flow.chunkhash_str]
+        send_ack(sock, flow, chunk_buf.last_in_order, chunk_buf.sack_ranges())
+
+def probe_failed(sock, flow):
+    """
+    no DATA or truncated DATA on a probing flow, ask the same holder again with a smaller payload
+    """
+    logger.info(f'payload {flow.payload_size} from {flow.addr} failed, flow: {flow.flow_id}')
+    path_mtu.fail(flow.addr, flow.payload_size)
+    cancel_flow(sock, flow)
+    chunk_buf = received_chunks.get(flow.chunkhash_str)
+    if chunk_buf is not None and chunk_buf.empty:
+        send_get(sock, flow.chunkhash_str, flow.addr)
+
+def on_timer(sock, key):
+    """
+    a deadline in timers is due, keys are Flows for probes and delayed ACKs, hashstrs
+    of chunks being downloaded for stalls, FSMs for pacing and peer_fsm keys for retransmissions
+    """
+    if isinstance(key, str):
+        check_stall(sock, key)
+    elif isinstance(key, IHaveBatcher):
+        for addr in key.waiting():
+            send_ihave(sock, addr)
+    elif isinstance(key, DownloadJournal):
+        if key is journal:
+            sync_journal()
+            timers.schedule(key, time.perf_counter() + config.journal_sync)
+    elif isinstance(key, Flow):
+        if not key.probe:
+            send_delayed_ack(sock, key)
+        elif download_flows.get(key.key) is key:
+            probe_failed(sock, key)
+    elif isinstance(key, FSM):
+        if key.state != State.FINISHED:
+            key.pace(sock)
+    elif key in peer_fsm:
+        fsm = peer_fsm[key]
+        if fsm.ttl <= 0 or time.perf_counter() - fsm.last_ack_time > config.send_idle:
+            # the receiver is gone, give its upload slot back
+            evict_fsm(key)
+        else:
+            # retransmit seq's pkt
+            fsm.expire(sock)
+
+def release_fsm(flow_key):
+    global num_concurrent_send
+    fsm = peer_fsm.pop(flow_key)
+    timers.cancel(flow_key)
+    timers.cancel(fsm)
+    # decrement concurrent send number
+    num_concurrent_send -= 1
+
+def evict_fsm(flow_key):
+    global evicted_flows
+    fsm = peer_fsm[flow_key]
+    logger.warning(f'evicted flow {flow_key}, {config.send_ttl - fsm.ttl} unanswered retransmits, '
+                   f'idle for {time.perf_counter() - fsm.last_ack_time:.1f}s')
+    release_fsm(flow_key)
+    evicted_flows += 1
+
+def new_chunk_buffer(chunkhash_str):
+    return ChunkBuffer(bytes.fromhex(chunkhash_str), merkle_root=config.merkle_roots.get(chunkhash_str))
+
+def stall_timeout(flow):
+    # the fixed timeout if set, the sender's timeout is not estimated then
+    rto = config.timeout if config.timeout > 0 else max(flow.rto, config.rto_min)
+    return STALL_RTOS * rto
+
+def check_stall(sock, chunkhash_str):
+    """
+    no new DATA of a chunk for stall_timeout, drop its flow and ask another holder
+    for the rest, or the same one again if it is the only holder known.
+    A chunk left without a flow by busy holders is asked for again.
+    """
+    flow = chunk_flows.get(chunkhash_str)
+    if flow is None:
+        if chunkhash_str in received_chunks:
+            rerequest_chunk(sock, chunkhash_str)
+        return
+    if flow.probe:
+        # probes have their own timeout, watch the flow once its payload size is settled
+        timers.schedule(chunkhash_str, time.perf_counter() + stall_timeout(flow))
+        return
+    chunk_buf = received_chunks[chunkhash_str]
+    logger.warning(f'flow {flow.flow_id} of {chunkhash_str} from {flow.addr} stalled, '
+                   f'{chunk_buf.last_in_order} of {chunk_buf.num_pkts} pkts in order')
+    cancel_flow(sock, flow)
+    holders = chunk_holders[chunkhash_str]
+    if len(holders) > 1:
+        holders.discard(flow.addr)
+    # the last holder is kept, a WHOHAS flood would not find it again
+    # as its IHAVE for the chunk is held back for IHAVE_INTERVAL
+    rerequest_chunk(sock, chunkhash_str)
+
+def get_denied(sock, flow, reason):
+    """
+    the holder has rejected the GET of a flow, ask it again for what it can send
+    """
+    if chunk_flows.get(flow.chunkhash_str) is not flow:
+        return
+    logger.warning(f'GET of flow {flow.flow_id} denied by {flow.addr}, reason: {reason}')
+    drop_flow(flow)
+    chunk_buf = received_chunks[flow.chunkhash_str]
+    other = other_holder(flow)
+    if reason == DENIED_BUSY:
+        # ask another holder, or the same ones again in BUSY_RETRY
+        if other is not None:
+            send_get(sock, flow.chunkhash_str, other)
+        else:
+            timers.schedule(flow.chunkhash_str, time.perf_counter() + BUSY_RETRY)
+        return
+    if reason == DENIED_RANGE:
+        # the holder disagrees on where the chunk ends, resume from another one
+        # or start over from it
+        if other is not None:
+            send_get(sock, flow.chunkhash_str, other)
+            return
+        chunk_buf.reset()
+        send_get(sock, flow.chunkhash_str, flow.addr)
+        return
+    # too large for the holder, propose() goes below it from now on
+    path_mtu.fail(flow.addr, flow.payload_size)
+    if not chunk_buf.empty:
+        # the buffered pkts fix the payload size, start over with one the holder takes
+        chunk_buf.reset()
+    send_get(sock, flow.chunkhash_str, flow.addr)
+
+def other_holder(flow):
+    # a holder of the flow's chunk to ask instead of the flow's sender, None if there is none
+    for holder in chunk_holders[flow.chunkhash_str]:
+        if holder != flow.addr and not avoid_holder(holder, flow.chunkhash_str) \
+                and count_flows(holder) < MAX_FLOWS_PER_PEER:
+            return holder
+    return None
+
+def retire_flow(flow):
+    """
+    drop the flow of a completed chunk, remembering how to answer its sender if it missed our last ACK
+    """
+    drop_flow(flow)
+    finished_flows[flow.key] = flow.num_pkts
+    if len(finished_flows) > MAX_FINISHED_FLOWS:
+        finished_flows.pop(next(iter(finished_flows)))
+
+def drop_flow(flow):
+    download_flows.pop(flow.key, None)
+    timers.cancel(flow)
+    if flow.probe:
+        # no answer on its payload size, the next flow may probe again
+        path_mtu.abandon(flow.addr)
+    if chunk_flows.get(flow.chunkhash_str) is flow:
+        chunk_flows.pop(flow.chunkhash_str)
+        timers.cancel(flow.chunkhash_str)
+
+def cancel_flow(sock, flow):
+    # drop a flow the sender may still be serving, and let it free its upload slot
+    drop_flow(flow)
+    sock.sendto(make_packet(DENIED, seq=flow.flow_id, ack=DENIED_FLOW), flow.addr)
+
+def send_get(sock, chunkhash_str, to_addr):
+    global next_flow_id
+    # open a new flow, its id goes in the seq field
+    chunk_buf = received_chunks[chunkhash_str]
+    payload_size, probe = chunk_buf.payload_size, False
+    if config.merkle is None and chunk_buf.empty:
+        # nothing received yet, so the payload size can still change
+        # merkle roots are over MIN_PAYLOAD pieces, no probing with --merkle
+        payload_size, probe = path_mtu.propose(to_addr)
+        if payload_size != chunk_buf.payload_size:
+            chunk_buf.set_payload_size(payload_size)
+    flow = Flow(to_addr, next_flow_id, chunkhash_str, payload_size, probe)
+    download_flows[flow.key] = flow
+    chunk_flows[chunkhash_str] = flow
+    next_flow_id += 1
+    if probe:
+        timers.schedule(flow, time.perf_counter() + PROBE_TIMEOUT)
+    timers.schedule(chunkhash_str, time.perf_counter() + stall_timeout(flow))
+    # |20byte chunkhash|1byte options|2byte payload size|4byte start seq|
+    # the sender starts right after the pkts we have in order, buffered ones are SACKed
+    options = GET_MERKLE if config.merkle is not None else 0
+    start_seq = chunk_buf.last_in_order
+    get_data = bytes.fromhex(chunkhash_str) + struct.pack("!BHI", options, payload_size, start_seq)
+    get_pkt = make_packet(GET, get_data, seq=flow.flow_id)
+    sock.sendto(get_pkt, to_addr)
+    logger.info(f'sent GET pkt to {to_addr}, data: {chunkhash_str}, flow: {flow.flow_id}, '
+                f'payload: {payload_size}{" (probe)" if probe else ""}, start: {start_seq}')
+
+def rerequest_chunk(sock, chunkhash_str):
+    """
+    request a chunk again from a holder that is neither avoided nor out of flows,
+    flood WHOHAS for it if there is no such holder
+    """
+    for holder in chunk_holders[chunkhash_str]:
+        if not avoid_holder(holder, chunkhash_str) and count_flows(holder) < MAX_FLOWS_PER_PEER:
+            send_get(sock, chunkhash_str, holder)
+            return
+    flood_whohas(sock, bytes.fromhex(chunkhash_str))
+
+def request_next_chunk(sock, from_addr):
+    """
+    request unrequested chunks from holders with spare flows after a chunk finishes,
+    preferring the peer that has just sent us one
+    """
+    for hash_str, if_finish in finished.items():
+        if if_finish or hash_str in chunk_flows:
+            continue
+        if hash_str not in received_chunks and len(received_chunks) >= config.max_buffers:
+            continue
+        holders = [h for h in chunk_holders[hash_str]
+                   if not avoid_holder(h, hash_str) and count_flows(h) < MAX_FLOWS_PER_PEER]
+        if len(holders) == 0:
+            continue
+        holder = from_addr if from_addr in holders else holders[0]
+        if hash_str not in received_chunks:
+            received_chunks[hash_str] = new_chunk_buffer(hash_str)
+        send_get(sock, hash_str, holder)
+
+def avoid_holder(addr, chunkhash_str):
+    """
+    whether addr has sent us the chunk corrupted while another holder has it,
+    flagged holders are asked again when no one else has the chunk
+    """
+    return (addr, chunkhash_str) in bad_holders and \
+        any((holder, chunkhash_str) not in bad_holders for holder in chunk_holders[chunkhash_str])
+
+def count_flows(addr):
+    # num of unfinished chunks a peer is sending us
+    return sum(1 for flow in chunk_flows.values() if flow.addr == addr)
 
 def process_user_input(sock):
     global LAST_COMMAND
@@ -299,7 +668,66 @@ def process_user_input(sock):
     else:
         pass
 
+def finish_download():
+    global journal
+    # dump your received chunk to file in dict form using pickle
+    chunk_writer.export()
+    if journal is not None:
+        timers.cancel(journal)
+        journal.remove()
+        journal = None
+
+    # you need to print "GOT" when finished downloading all chunks in a DOWNLOAD file
+    logger.info(f"GOT {ex_output_file}")
+
+def resume_download():
+    """
+    take back the progress of an interrupted DOWNLOAD of the same target, complete
+    chunks are checked against their chunkhash and partial ones are resumed by
+    ranged GETs once holders reply IHAVE
+    """
+    for chunkhash_str in journal.completed:
+        chunkhash = bytes.fromhex(chunkhash_str)
+        data = chunk_writer.read(chunkhash_str)
+        if hashlib.sha1(data).digest() != chunkhash:
+            logger.warning(f'journaled chunk {chunkhash_str} fails sha1 check, downloading it again')
+            continue
+        finished[chunkhash_str] = True
+        chunk_writer.written.add(chunkhash_str)
+        config.haschunks[chunkhash] = data
+    for chunkhash_str, (payload_size, pkts) in journal.partial.items():
+        if finished.get(chunkhash_str) is not False or len(received_chunks) >= config.max_buffers:
+            continue
+        chunk_buf = new_chunk_buffer(chunkhash_str)
+        chunk_buf.set_payload_size(payload_size)
+        chunk_buf.restore(chunk_writer.read(chunkhash_str), pkts)
+        received_chunks[chunkhash_str] = chunk_buf
+    logger.info(f'resumed {len(chunk_writer.written)} complete and {len(received_chunks)} partial chunks '
+                f'from {journal.path}')
+
+def sync_journal():
+    """
+    stage the new in-order data of unfinished chunks in the spool, flush the spool,
+    then append the records of what has been flushed to the journal
+    """
+    for chunkhash_str, chunk_buf in received_chunks.items():
+        done = min(chunk_buf.last_in_order * chunk_buf.payload_size, chunk_buf.size)
+        mark = journal.partial.get(chunkhash_str)
+        journaled = min(mark[0] * mark[1], chunk_buf.size) if mark is not None else 0
+        if done == journaled:
+            continue
+        if done > journaled:
+            chunk_writer.stage(chunkhash_str, chunk_buf.getbuffer()[journaled: done], journaled)
+        # lower after a reset, the data past it may be corrupted
+        journal.progress(chunkhash_str, chunk_buf.payload_size, chunk_buf.last_in_order)
+    chunk_writer.flush()
+    journal.sync()
+
 def restart_download(sock):
+    """
+    flood WHOHAS for every unfinished chunk, partial chunks are kept and
+    resumed by ranged GETs when the IHAVEs come back
+    """
     logger.info('begin restart_download')
     download_hash = bytes()
     
@@ -307,47 +735,64 @@ def restart_download(sock):
         if not if_finish:
             hash =  bytes.fromhex(hash_str)
             download_hash += hash
-            if hash_str in received_chunks:
-                received_chunks.pop(hash_str)
-            # received_chunks[hash_str] = bytes()
 
-    whohas_header = struct.pack("HBBHHII", socket.htons(MAGIC), TEAM, WHOHAS, socket.htons(HEADER_LEN),
-                                    socket.htons(HEADER_LEN + len(download_hash)), socket.htonl(0), socket.htonl(0))
-    whohas_pkt = whohas_header + download_hash
+    flood_whohas(sock, download_hash)
+
+def flood_whohas(sock, download_hash):
+    # batches of chunkhashes that fit in a pkt, the batch index in seq and the num of batches in ack
+    payloads = batches(split_hashes(download_hash))
+    whohas_pkts = [make_packet(WHOHAS, payload, seq=i, ack=len(payloads)) for i, payload in enumerate(payloads)]
 
     peer_list = config.peers
     for p in peer_list:  # nodeid, hostname, port
         if int(p[0]) != config.identity:
-            sock.sendto(whohas_pkt, (p[1], int(p[2])))
+            for whohas_pkt in whohas_pkts:
+                sock.sendto(whohas_pkt, (p[1], int(p[2])))
+
+def send_ihave(sock, to_addr):
+    payloads = ihave_batcher.take(to_addr)
+    for i, payload in enumerate(payloads):
+        sock.sendto(make_packet(IHAVE, payload, seq=i, ack=len(payloads)), to_addr)
+    if len(payloads) > 0:
+        logger.info(f'sent IHAVE pkts to {to_addr}, {sum(map(len, payloads)) // HASH_LEN} chunks '
+                    f'in {len(payloads)} pkts')
 
 def peer_run(config):
     addr = (config.ip, config.port)
     sock = simsocket.SimSocket(config.identity, addr, verbose=config.verbose)
-    # 统计window size
-    window_size = defaultdict(list)
-    # 统计window size 此时的时间
-    time_window_size = defaultdict(list)
     global peer_fsm
     global last_get_data_time
+    ring = None
+    if config.recv_ring > 0:
+        # a thread reads the socket, we select on the ring instead
+        ring = RecvRing(sock, BUF_SIZE, config.recv_ring)
+        ring.start()
+    elif config.batch > 1:
+        # a full send buffer now drops the pkt instead of blocking, see SimSocket.sendto
+        sock.setblocking(False)
 
     try:
         while True:
-            dead_peers = []
-            for peer_addr, fsm in peer_fsm.items():
-                if time.perf_counter() - fsm.timer.send_time > fsm.timeout:
-                    # timeout occured, retransmit seq's pkt
-                    fsm.state = fsm.transition_table[fsm.state][Event.TIMEOUT](sock, fsm.timer.seq - 1)
-                    # double the timeout interval
-                    fsm.timeout *= 2
-                time_passed = time.perf_counter() - start
-                time_window_size[peer_addr].append(time_passed)
-                window_size[peer_addr].append(fsm.cwnd)
-                logger.info(f'peer_addr: {peer_addr}, fsm.__cwnd: {fsm.cwnd}')
-            ready = select.select([sock, sys.stdin], [], [], 0.1)
+            # only flows whose timer is due
+            for key in timers.pop_due(time.perf_counter()):
+                on_timer(sock, key)
+            sample_window_sizes()
+
+            # sleep until the next timer is due
+            wait = MAX_SELECT_WAIT
+            deadline = timers.next_deadline()
+            if deadline is not None:
+                wait = min(max(deadline - time.perf_counter(), 0), wait)
+            ready = select.select([sock if ring is None else ring, sys.stdin], [], [], wait)
             read_ready = ready[0]
             if len(read_ready) > 0:
+                if ring is not None and ring in read_ready:
+                    process_inbound_ring(sock, ring)
                 if sock in read_ready:
-                    process_inbound_udp(sock)
+                    if config.batch > 1:
+                        process_inbound_batch(sock)
+                    else:
+                        process_inbound_udp(sock)
                 if sys.stdin in read_ready:
                     process_user_input(sock)
             else:
@@ -357,7 +802,7 @@ def peer_run(config):
             # no conn left but tasks not all finish --> send WHOHAS for unfinisg tasks
             if not last_get_data_time is None:
                 logger.info(f'dataTime: {time.time()-last_get_data_time }')
-                if time.time()-last_get_data_time > 5 and not all(finished.values()):
+                if time.time()-last_get_data_time > RESTART_TIMEOUT and not all(finished.values()):
                     last_get_data_time = time.time()
                     restart_download(sock)
 
@@ -365,10 +810,89 @@ def peer_run(config):
     except KeyboardInterrupt:
         pass
     finally:
+        if ring is not None:
+            ring.stop()
+            logger.info(f'recv ring max occupancy: {ring.max_occupancy}, overflows: {ring.overflows}')
         plot_window_size(addr,time_window_size, window_size)
         logger.info(window_size)
+        logger.info(f'evicted sending flows: {evicted_flows}')
+        if journal is not None:
+            sync_journal()
+        if sock.batches > 0:
+            logger.info(f'recv batches: {sock.batches}, avg batch: {sock.batched_pkts / sock.batches:.2f}, '
+                        f'max batch: {sock.max_batch}, kernel drops: {sock.kernel_drops}, send drops: {sock.send_drops}')
         sock.close()
 
+def peer_run_async(config):
+    try:
+        asyncio.run(serve(config))
+    except KeyboardInterrupt:
+        pass
+
+async def serve(config):
+    """
+    asyncio runtime: pkts, stdin commands, retransmission deadlines and
+    the stalled download check are all driven by the event loop, without a tick.
+    """
+    global timers
+    loop = asyncio.get_running_loop()
+    addr = (config.ip, config.port)
+    sim_sock = simsocket.SimSocket(config.identity, addr, verbose=config.verbose)
+
+    def on_pkt(sock, pkt, from_addr):
+        process_pkt(sock, pkt, from_addr)
+        sample_window_sizes()
+
+    def on_loop_timer(key):
+        on_timer(sock, key)
+        sample_window_sizes()
+
+    def on_input():
+        try:
+            process_user_input(sock)
+        except EOFError:
+            loop.remove_reader(sys.stdin)
+
+    def check_stalled():
+        # no conn left but tasks not all finish --> send WHOHAS for unfinisg tasks
+        global last_get_data_time
+        wait = RESTART_TIMEOUT
+        if last_get_data_time is not None and not all(finished.values()):
+            idle = time.time() - last_get_data_time
+            if idle > RESTART_TIMEOUT:
+                last_get_data_time = time.time()
+                restart_download(sock)
+            else:
+                wait = RESTART_TIMEOUT - idle
+        loop.call_later(wait, check_stalled)
+
+    timers = LoopTimers(loop, on_loop_timer)
+    _, sock = await loop.create_datagram_endpoint(lambda: simsocket.SimDatagramProtocol(sim_sock, on_pkt),
+                                                  sock=sim_sock.raw_socket())
+    loop.add_reader(sys.stdin, on_input)
+    loop.call_later(RESTART_TIMEOUT, check_stalled)
+    try:
+        await loop.create_future()
+    finally:
+        loop.remove_reader(sys.stdin)
+        plot_window_size(addr, time_window_size, window_size)
+        logger.info(window_size)
+        logger.info(f'evicted sending flows: {evicted_flows}')
+        if journal is not None:
+            sync_journal()
+        sock.close()
+
+def sample_window_sizes():
+    global next_sample
+    now = time.perf_counter()
+    if now < next_sample:
+        return
+    next_sample = now + MAX_SELECT_WAIT
+    for flow_key, fsm in peer_fsm.items():
+        time_window_size[flow_key].append(now - start)
+        window_size[flow_key].append(fsm.cwnd)
+        logger.info(f'flow: {flow_key}, fsm.__cwnd: {fsm.cwnd}')
+
 def plot_window_size(addr,time_window_size, window_size):
     plt.figure()
     for peer_addr, time_window_size_list in time_window_size.items():
@@ -381,12 +905,32 @@ def plot_window_size(addr,time_window_size, window_size):
 if __name__ == '__main__':
     """
     -p: Peer list file, it will be in the form "*.map" like nodes.map.
-    -c: Chunkfile, a dictionary dumped by pickle. It will be loaded automatically in bt_utils. The loaded dictionary has the form: {chunkhash: chunkdata}
+    -c: Chunkfile, a chunk store written by util/chunk_store.py or util/make_data.py, or a dictionary dumped by pickle.
+        It will be loaded automatically in bt_utils as a mapping of the form: {chunkhash digest: chunkdata}
     -m: The max number of peer that you can send chunk to concurrently. If more peers ask you for chunks, you should reply "DENIED"
     -i: ID, it is the index in nodes.map
     -v: verbose level for printing logs to stdout, 0 for no verbose, 1 for WARNING level, 2 for INFO, 3 for DEBUG.
     -t: pre-defined timeout. If it is not set, you should estimate timeout via RTT. If it is set, you should not change this time out.
         The timeout will be set when running test scripts. PLEASE do not change timeout if it set.
+    --send-ttl: evict a sending flow after this many retransmits in a row without an ACK.
+    --send-idle: evict a sending flow that has not been ACKed for this many seconds.
+    --rto-min, --rto-max: bounds of estimated and backed off timeouts in seconds.
+    --gbn: use Go-Back-N instead of selective repeat when sending a chunk.
+    --no-pacing: send a whole window at once instead of spreading it over the RTT.
+    --cc: congestion control of the chunks we send, reno, cubic or bbr.
+    --max-buffers: the max number of chunks being downloaded at the same time, each of them holds a chunk-sized buffer.
+    --batch: the max number of pkts read per wakeup from a non-blocking socket, 1 to read one pkt per wakeup.
+    --recv-ring: read the socket in a thread into a ring of this many pkts, 0 to read it in the select loop.
+    --delayed-ack: ACK every this many in-order DATA pkts or after 10ms, out-of-order pkts are always ACKed at once.
+        1 to ACK every pkt.
+    --max-payload: the largest DATA payload asked for, the path to every sender is probed for it.
+        1024 to always use 1024-byte payloads.
+    --pkt-cache: cache up to this many prebuilt DATA pkts of hot chunks, 0 for no cache.
+    --asyncio: run the peer on an asyncio event loop instead of the select loop.
+    --journal-sync: keep a journal of the DOWNLOAD next to the output file, synced every this many seconds,
+        so that a restarted peer given the same DOWNLOAD only fetches what is missing. 0 for no journal.
+    --merkle: ask senders for a merkle proof in every DATA pkt and drop corrupted pkts one by one.
+        Optionally followed by a master.merkle file written by util/make_data.py --merkle holding trusted roots.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', type=str, help='<peerfile>     The list of all peers', default='nodes.map')
@@ -395,9 +939,35 @@ if __name__ == '__main__':
     parser.add_argument('-i', type=int, help='<identity>     Which peer # am I?')
     parser.add_argument('-v', type=int, help='verbose level', default=0)
     parser.add_argument('-t', type=int, help="pre-defined timeout", default=0)
+    parser.add_argument('--send-ttl', type=int, help='max # of unanswered retransmits in a row', default=bt_utils.SEND_TTL)
+    parser.add_argument('--send-idle', type=float, help='max seconds a sending flow goes without ACKs', default=bt_utils.SEND_IDLE)
+    parser.add_argument('--rto-min', type=float, help='min retransmission timeout', default=bt_utils.RTO_MIN)
+    parser.add_argument('--rto-max', type=float, help='max retransmission timeout', default=bt_utils.RTO_MAX)
+    parser.add_argument('--gbn', action='store_true', help='use Go-Back-N instead of selective repeat when sending')
+    parser.add_argument('--no-pacing', action='store_true', help='do not pace sending flows')
+    parser.add_argument('--cc', choices=sorted(CONGESTION_CONTROLS), help='congestion control', default='reno')
+    parser.add_argument('--max-buffers', type=int, help='max # of chunks downloaded concurrently', default=bt_utils.MAX_BUFFERS)
+    parser.add_argument('--batch', type=int, help='max # of pkts read per wakeup', default=bt_utils.BATCH)
+    parser.add_argument('--recv-ring', type=int, help='# of slots of the receive thread ring, 0 for no thread', default=0)
+    parser.add_argument('--delayed-ack', type=int, help='ACK every # in-order DATA pkts',
+                        default=bt_utils.DELAYED_ACK)
+    parser.add_argument('--max-payload', type=int, help='largest DATA payload probed for',
+                        default=bt_utils.MAX_PAYLOAD)
+    parser.add_argument('--pkt-cache', type=int, help='max # of DATA pkts cached, 0 for no cache', default=0)
+    parser.add_argument('--asyncio', action='store_true', help='run on an asyncio event loop')
+    parser.add_argument('--journal-sync', type=float, help='seconds between download journal syncs, 0 for none',
+                        default=bt_utils.JOURNAL_SYNC)
+    parser.add_argument('--merkle', type=str, nargs='?', const='', default=None,
+                        help='verify every DATA pkt with merkle proofs, against the roots in this file if given')
     args = parser.parse_args()
 
     config = bt_utils.BtConfig(args)
     logger = logging.getLogger(f"PEER{args.i}_LOGGER")
     start = time.perf_counter()
-    peer_run(config)
\ No newline at end of file
+    if config.pkt_cache > 0:
+        pkt_cache = DataPacketCache(config.pkt_cache)
+    path_mtu = PathMTU(config.max_payload)
+    if args.asyncio:
+        peer_run_async(config)
+    else:
+        peer_run(config)
\ No newline at end of file
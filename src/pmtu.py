@@ -0,0 +1,47 @@
+from util.packet import MAX_PKT_SIZE, HEADER_LEN, MIN_PAYLOAD
+PROBE_TIMEOUT = 2           # a probing flow without any DATA for this long has failed
+PROBE_STEP = 32             # stop searching once the bounds are this close
+
+class PathMTU():
+    '''
+    Largest DATA payload from each sender, searched in the spirit of PLPMTUD.
+    Every GET proposes a payload size, normally the largest one known to work.
+    While the search of a peer is open, one of its flows at a time is a probe:
+    it asks for the ceiling first, then for the midpoint of the bounds. A probe
+    succeeds on its first full-sized DATA pkt and fails if DATA arrives truncated
+    or does not arrive in PROBE_TIMEOUT, in which case the chunk is requested
+    again with the confirmed size.
+    '''
+    def __init__(self, max_payload) -> None:
+        self.max_payload = min(max(max_payload, MIN_PAYLOAD), MAX_PKT_SIZE - HEADER_LEN)
+        self.__confirmed = dict()                        # addr -> largest payload received from it
+        self.__failed = dict()                           # addr -> smallest payload that failed
+        self.__probing = set()                           # addrs with a probing flow
+
+    def propose(self, addr):
+        '''
+        (payload size, whether it is a probe) for a new flow from addr.
+        '''
+        low = self.__confirmed.get(addr, MIN_PAYLOAD)
+        high = self.__failed.get(addr, self.max_payload + 1)
+        if addr in self.__probing or high - low <= PROBE_STEP:
+            return low, False
+        self.__probing.add(addr)
+        if addr not in self.__failed:
+            return self.max_payload, True
+        return (low + high) // 2, True
+
+    def confirm(self, addr, payload_size):
+        self.__probing.discard(addr)
+        self.__confirmed[addr] = max(self.__confirmed.get(addr, MIN_PAYLOAD), payload_size)
+
+    def abandon(self, addr):
+        # the probe ended without telling anything, e.g. the sender was busy
+        self.__probing.discard(addr)
+
+    def fail(self, addr, payload_size):
+        self.__probing.discard(addr)
+        self.__failed[addr] = min(self.__failed.get(addr, self.max_payload + 1), payload_size)
+        if self.__confirmed.get(addr, MIN_PAYLOAD) >= payload_size:
+            # got through once but is refused now, e.g. denied by the sender
+            self.__confirmed.pop(addr, None)
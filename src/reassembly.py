@@ -0,0 +1,128 @@
+import hashlib
+from util import merkle
+from util.packet import CHUNK_DATA_SIZE, MIN_PAYLOAD
+
+MAX_SACK_BLOCKS = 32
+
+class ChunkBuffer():
+    '''
+    Reassembly buffer of a chunk being downloaded.
+    The whole chunk is preallocated once and every DATA payload is
+    written in place at (seq - 1) * payload_size, so receiving a chunk
+    costs one copy per byte instead of one copy per packet.
+    Out-of-order pkts are kept and tracked in a received bitmap.
+    The SHA-1 of the chunk is computed incrementally as data becomes
+    in-order, so verifying a complete chunk costs O(1).
+    '''
+    def __init__(self, chunkhash, size=CHUNK_DATA_SIZE, payload_size=MIN_PAYLOAD, merkle_root=None) -> None:
+        self.chunkhash = chunkhash                       # expected sha1 digest of the chunk, 20 bytes
+        self.trusted_root = merkle_root                  # merkle root from make_data.py --merkle, if known
+        self.size = size
+        self.payload_size = payload_size
+        self.num_pkts = (size + payload_size - 1) // payload_size
+
+        self.__data = bytearray(size)
+        self.__view = memoryview(self.__data)
+        self.reset()
+
+    def set_payload_size(self, payload_size):
+        '''
+        Switch to another payload size, discarding everything received so far.
+        '''
+        self.payload_size = payload_size
+        self.num_pkts = (self.size + payload_size - 1) // payload_size
+        self.reset()
+
+    def reset(self):
+        '''
+        Discard everything received so far.
+        '''
+        self.__bitmap = bytearray(self.num_pkts + 1)     # bitmap[seq] == 1 if pkt seq is received, seq starts from 1
+        self.__highest = 0                               # the highest received seq
+        self.__sha1 = hashlib.sha1()                     # running hash of data up to last_in_order
+        self.merkle_root = self.trusted_root             # root every piece is verified against
+        self.last_in_order = 0                           # every pkt up to this seq has been received
+
+    def write(self, seq, data):
+        '''
+        Write the payload of DATA pkt `seq` (1-based) into the buffer.
+        Return False if the pkt is out of range, a duplicate or of the wrong size.
+        '''
+        if seq < 1 or seq > self.num_pkts or self.__bitmap[seq]:
+            return False
+        left = (seq - 1) * self.payload_size
+        right = min(left + self.payload_size, self.size)
+        if len(data) != right - left:
+            # truncated on the way or sent with another payload size
+            return False
+        self.__view[left: right] = data
+        self.__bitmap[seq] = 1
+        self.__highest = max(self.__highest, seq)
+
+        # advance the in-order point over buffered pkts and hash the newly in-order data
+        last_in_order = self.last_in_order
+        while self.last_in_order < self.num_pkts and self.__bitmap[self.last_in_order + 1]:
+            self.last_in_order += 1
+        if self.last_in_order > last_in_order:
+            self.__sha1.update(self.__view[last_in_order * self.payload_size:
+                                           min(self.last_in_order * self.payload_size, self.size)])
+        return True
+
+    def restore(self, data, num_pkts):
+        '''
+        Take the first num_pkts pkts back from data holding a prefix of the chunk, e.g. a spool slot.
+        '''
+        for seq in range(1, min(num_pkts, self.num_pkts) + 1):
+            self.write(seq, data[(seq - 1) * self.payload_size: min(seq * self.payload_size, self.size)])
+
+    def verify_piece(self, seq, data, proof):
+        '''
+        Check the payload of DATA pkt `seq` against its merkle proof.
+        Without a trusted root, the first valid proof pins the root of the chunk,
+        a sender lying about it is caught by the sha1 check of the whole chunk.
+        '''
+        root = merkle.verify_piece(data, seq - 1, proof)
+        if root is None or (self.merkle_root is not None and root != self.merkle_root):
+            return False
+        self.merkle_root = root
+        return True
+
+    def sack_ranges(self):
+        '''
+        Received blocks above last_in_order as [(start, end)], both ends inclusive.
+        '''
+        ranges = []
+        seq = self.last_in_order + 2
+        while seq <= self.__highest and len(ranges) < MAX_SACK_BLOCKS:
+            if self.__bitmap[seq]:
+                start = seq
+                while seq < self.__highest and self.__bitmap[seq + 1]:
+                    seq += 1
+                ranges.append((start, seq))
+            seq += 1
+        return ranges
+
+    @property
+    def empty(self):
+        return self.__highest == 0
+
+    @property
+    def has_gaps(self):
+        # out-of-order pkts are buffered above a hole
+        return self.__highest > self.last_in_order
+
+    @property
+    def complete(self):
+        return self.last_in_order == self.num_pkts
+
+    def verify(self):
+        '''
+        Whether the complete chunk matches its chunkhash.
+        '''
+        return self.complete and self.__sha1.digest() == self.chunkhash
+
+    def getvalue(self):
+        return bytes(self.__data)
+
+    def getbuffer(self):
+        return self.__view
@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import time
+
+class TimerHeap():
+    '''
+    Retransmission deadlines of all sending flows, keyed by flow.
+    A heap with lazy deletion: a key has at most one live entry in the heap,
+    rearming a key to a later deadline only records the new deadline, and the
+    entry is pushed back with it when it reaches the top. Cancelling drops the
+    key, its entry is discarded when it surfaces. Deadlines move forward on
+    almost every ACK, so rearm and cancel are O(1) in the common case.
+    '''
+    def __init__(self) -> None:
+        self.__deadlines = dict()                        # key -> deadline
+        self.__entries = dict()                          # key -> (entry id, deadline) of its live heap entry
+        self.__heap = []                                 # (deadline, entry id, key), ids break ties
+        self.__ids = itertools.count()
+
+    def schedule(self, key, deadline):
+        self.__deadlines[key] = deadline
+        entry = self.__entries.get(key)
+        if entry is not None and entry[1] <= deadline:
+            # the live entry surfaces early enough and is pushed back then
+            return
+        self.__push(key, deadline)
+
+    def cancel(self, key):
+        self.__deadlines.pop(key, None)
+        self.__entries.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.__deadlines
+
+    def __len__(self):
+        return len(self.__deadlines)
+
+    def __push(self, key, deadline):
+        entry_id = next(self.__ids)
+        self.__entries[key] = (entry_id, deadline)
+        heapq.heappush(self.__heap, (deadline, entry_id, key))
+
+    def next_deadline(self):
+        '''
+        The earliest deadline, None if no timer is armed.
+        '''
+        while self.__heap:
+            deadline, entry_id, key = self.__heap[0]
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] != entry_id:
+                # cancelled or superseded
+                heapq.heappop(self.__heap)
+                continue
+            if self.__deadlines[key] > deadline:
+                # rearmed later since it was pushed
+                heapq.heappop(self.__heap)
+                self.__push(key, self.__deadlines[key])
+                continue
+            return deadline
+        return None
+
+    def pop_due(self, now):
+        '''
+        Disarm and return the keys whose deadline is not after now, earliest first.
+        '''
+        due = []
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return due
+            _, _, key = heapq.heappop(self.__heap)
+            self.cancel(key)
+            due.append(key)
+
+class LoopTimers():
+    '''
+    TimerHeap for the asyncio runtime, callback(key) is called from the event
+    loop when the deadline of key is due. Deadlines are time.perf_counter()
+    seconds. Every key holds one loop.call_at handle; like TimerHeap, rearming
+    to a later deadline only records it and the handle arms itself again when
+    it fires early.
+    '''
+    def __init__(self, loop, callback) -> None:
+        self.__loop = loop
+        self.__callback = callback
+        self.__deadlines = dict()                        # key -> deadline
+        self.__handles = dict()                          # key -> (handle, deadline it fires at)
+
+    def schedule(self, key, deadline):
+        self.__deadlines[key] = deadline
+        entry = self.__handles.get(key)
+        if entry is not None:
+            if entry[1] <= deadline:
+                return
+            entry[0].cancel()
+        self.__arm(key, deadline)
+
+    def cancel(self, key):
+        self.__deadlines.pop(key, None)
+        entry = self.__handles.pop(key, None)
+        if entry is not None:
+            entry[0].cancel()
+
+    def __contains__(self, key):
+        return key in self.__deadlines
+
+    def __len__(self):
+        return len(self.__deadlines)
+
+    def __arm(self, key, deadline):
+        when = self.__loop.time() + deadline - time.perf_counter()
+        self.__handles[key] = (self.__loop.call_at(when, self.__fire, key), deadline)
+
+    def __fire(self, key):
+        self.__handles.pop(key, None)
+        deadline = self.__deadlines.get(key)
+        if deadline is None:
+            return
+        if deadline > time.perf_counter():
+            # rearmed later since the handle was armed
+            self.__arm(key, deadline)
+            return
+        self.__deadlines.pop(key)
+        self.__callback(key)
@@ -1,11 +1,14 @@
-import struct
 import socket
 import logging
 import select
 import os
+import sys
 
-SpiffyHeaderLen = struct.calcsize("I4s4sHH")
-StdHeaderLen = struct.calcsize("HBBHHII")
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.packet import HEADER, SPIFFY_HEADER
+
+SpiffyHeaderLen = SPIFFY_HEADER.size
+StdHeaderLen = HEADER.size
 _MAXBUFSIZE = 1500
 
 class StdPkt:
@@ -21,6 +24,13 @@ class StdPkt:
         self.to_addr = to_addr
         self.pkt_bytes = pkt_btyes
 
+    @property
+    def payload(self):
+        return self.pkt_bytes[SpiffyHeaderLen + self.header_len:]
+
+    def set_payload(self, payload):
+        self.pkt_bytes = self.pkt_bytes[:SpiffyHeaderLen + self.header_len] + payload
+
 class CheckerSocket:
     def __init__(self, addr) -> None:
         self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -42,19 +52,13 @@ class CheckerSocket:
         
     def recv_pkt_from(self):
         read_pkt_byte, from_addr = self.__sock.recvfrom(_MAXBUFSIZE)
-        mixedheaders = read_pkt_byte[:SpiffyHeaderLen+StdHeaderLen]
-        s_head_ID, s_head_lSrcAddr, s_head_lDestAddr, s_head_lSrcPort, s_head_lDestPort = struct.unpack("I4s4sHH", mixedheaders[:SpiffyHeaderLen])
+        s_head_ID, s_head_lSrcAddr, s_head_lDestAddr, s_head_lSrcPort, s_head_lDestPort = SPIFFY_HEADER.unpack_from(read_pkt_byte)
         s_head_lSrcAddr = socket.inet_ntoa(s_head_lSrcAddr)
         s_head_lDestAddr = socket.inet_ntoa(s_head_lDestAddr)
         s_head_lSrcPort = socket.ntohs(s_head_lSrcPort)
         s_head_lDestPort = socket.ntohs(s_head_lDestPort)
 
-        magic, team, pkt_type, header_len, pkt_len, seq, ack = struct.unpack("HBBHHII", mixedheaders[SpiffyHeaderLen:])
-        magic = socket.ntohs(magic)
-        header_len = socket.ntohs(header_len)
-        pkt_len = socket.ntohs(pkt_len)
-        seq = socket.ntohl(seq)
-        ack = socket.ntohl(ack)
+        magic, team, pkt_type, header_len, pkt_len, seq, ack = HEADER.unpack_from(read_pkt_byte, SpiffyHeaderLen)
 
         # can_read, _, _ = select.select([self.__sock], [], [], 1)
         # if len(can_read) > 0:
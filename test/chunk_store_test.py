@@ -0,0 +1,89 @@
+import pytest
+import pickle
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.chunk_store import ChunkStore, FragmentWriter, write_chunk_store, load_chunk_store, is_chunk_store
+
+'''
+This test examines the chunk store peers read their chunks from.
+Chunks are written into a store file and read back through its mmap, a pickled
+.fragment file is converted on load, and the fragment writer dumps a dict a plain
+pickle.load can read.
+'''
+
+CHUNK_SIZE = 64
+FRAGMENT = os.path.join(os.path.dirname(__file__), "tmp2", "data2.fragment")
+
+def make_chunks(num_chunks):
+    chunks = [bytes([i]) * CHUNK_SIZE for i in range(num_chunks)]
+    return [(hashlib.sha1(data).digest(), data) for data in chunks]
+
+@pytest.fixture
+def store_path():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    yield path
+    os.remove(path)
+
+def test_read(store_path):
+    chunks = make_chunks(3)
+    with open(store_path, "wb") as store_file:
+        write_chunk_store(store_file, chunks, len(chunks), CHUNK_SIZE)
+
+    assert is_chunk_store(store_path)
+    store = ChunkStore(store_path)
+    assert len(store) == 3 and store.chunk_size == CHUNK_SIZE
+    for digest, data in chunks:
+        assert digest in store and digest.hex() in store
+        chunk = store[digest.hex()]
+        # served from the mapping, not copied
+        assert isinstance(chunk, memoryview) and chunk.readonly
+        assert bytes(chunk) == data
+    assert set(store.keys()) == {digest for digest, _ in chunks}
+
+def test_add(store_path):
+    chunks = make_chunks(2)
+    with open(store_path, "wb") as store_file:
+        write_chunk_store(store_file, chunks[:1], 1, CHUNK_SIZE)
+
+    store = ChunkStore(store_path)
+    digest, data = chunks[1]
+    assert digest not in store
+    store[digest.hex()] = data
+    assert store[digest] is data and len(store) == 2
+
+def test_empty(store_path):
+    store = ChunkStore(store_path)
+    assert len(store) == 0 and "00" * 20 not in store
+
+def test_not_a_store(store_path):
+    with open(store_path, "wb") as store_file:
+        store_file.write(b"x" * 64)
+    assert not is_chunk_store(store_path)
+    with pytest.raises(ValueError):
+        ChunkStore(store_path)
+
+def test_load_fragment():
+    store = load_chunk_store(FRAGMENT)
+    with open(FRAGMENT, "rb") as fragment_file:
+        fragment = pickle.load(fragment_file)
+
+    assert len(store) == len(fragment)
+    for chunkhash_str, data in fragment.items():
+        assert hashlib.sha1(store[chunkhash_str]).hexdigest() == chunkhash_str
+        assert store[chunkhash_str] == data
+
+def test_fragment_writer():
+    chunks = make_chunks(3)
+    file = io.BytesIO()
+    writer = FragmentWriter(file)
+    for digest, data in chunks:
+        writer.add(digest.hex(), data)
+    writer.close()
+
+    assert pickle.loads(file.getvalue()) == {digest.hex(): data for digest, data in chunks}
@@ -0,0 +1,64 @@
+import grader
+import pytest
+import os
+
+'''
+This test examines the congestion controllers chosen with --cc.
+The transfer of the basic transfer test is run with cubic and with bbr, with the
+150th DATA pkt dropped, and the chunk should arrive intact with either.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for packet loss), for cc in cubic and bbr:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1 --cc <cc>
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2 --cc <cc>
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+'''
+
+DROP_AT = 150
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+RESULT = "test/tmp2/download_result.fragment"
+
+@pytest.fixture(scope='module', params=["cubic", "bbr"])
+def cc_session(request):
+    num_data = [0]
+    # seq of the dropped pkt, and how many times it is sent again
+    dropped = {"seq": None, "resent": 0}
+
+    def drop(pkt):
+        if pkt.pkt_type == 3:
+            num_data[0] += 1
+            if num_data[0] == DROP_AT:
+                dropped["seq"] = pkt.seq
+                return None
+            if pkt.seq == dropped["seq"]:
+                dropped["resent"] += 1
+        return pkt
+
+    if os.path.exists(RESULT):
+        os.remove(RESULT)
+
+    cc_session = grader.GradingSession(grader.filter_handler(drop))
+    cc_session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"],
+                         extra_args=f"--cc {request.param}")
+    cc_session.run_grader()
+
+    cc_session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD test/tmp2/download_target.chunkhash {RESULT}\n''')
+    success = cc_session.wait_for_file(RESULT, 80)
+    cc_session.terminate_peers()
+
+    return cc_session, success, num_data[0], dropped["resent"]
+
+def test_finish(cc_session):
+    session, success, num_data, resent = cc_session
+    assert success == True, "Fail to complete transfer or timeout"
+    assert num_data > DROP_AT, "no DATA pkt dropped"
+    grader.check_content(RESULT, [TARGET_HASH])
+
+def test_retransmit(cc_session):
+    session, success, num_data, resent = cc_session
+    # the dropped pkt is sent again, not the whole chunk
+    assert resent > 0, "the dropped pkt is not sent again"
+    assert session.peer_list[("127.0.0.1", 48001)].send_record[("127.0.0.1", 48002)][2] == 1, "the chunk is asked for again"
@@ -0,0 +1,91 @@
+import grader
+import pytest
+import os
+
+'''
+This test examines how your peer deals with a holder sending corrupted data.
+One DATA pkt of the first transfer is corrupted on the way, so the chunk fails its sha1 check.
+With another holder of the chunk, peer1 should download it from that one instead.
+When the corrupting holder is the only one, peer1 should ask it again rather than give up.
+
+.fragment files:
+data4-1.fragment: chunk1
+data4-2.fragment: chunk2
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for the corruption):
+python3 src/peer.py -p test/tmp4/nodes4.map -c test/tmp4/data4-1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp4/nodes4.map -c test/tmp4/data4-2.fragment -m 1 -i 2
+python3 src/peer.py -p test/tmp4/nodes4.map -c test/tmp4/data4-2.fragment -m 1 -i 3
+DOWNLOAD test/tmp4/download_target4.chunkhash test/tmp4/download_result.fragment (in peer1)
+
+and then:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+'''
+
+CORRUPT_SEQ = 5
+
+def run_session(nodes_map, fragments, target, result):
+    corrupted = []
+
+    def corrupt(pkt):
+        if pkt.pkt_type == 3 and pkt.seq == CORRUPT_SEQ and not corrupted:
+            # flip the first payload byte
+            payload = pkt.payload
+            pkt.set_payload(bytes([payload[0] ^ 0xff]) + payload[1:])
+            corrupted.append(pkt.from_addr)
+        return pkt
+
+    if os.path.exists(result):
+        os.remove(result)
+
+    session = grader.GradingSession(grader.filter_handler(corrupt))
+    session.add_peers(nodes_map, fragments)
+    session.run_grader()
+
+    session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD {target} {result}\n''')
+    success = session.wait_for_file(result, 80)
+    session.terminate_peers()
+
+    return session, success, corrupted
+
+@pytest.fixture(scope='module')
+def other_holder_session():
+    return run_session("test/tmp4/nodes4.map",
+                       ["test/tmp4/data4-1.fragment", "test/tmp4/data4-2.fragment", "test/tmp4/data4-2.fragment"],
+                       "test/tmp4/download_target4.chunkhash", "test/tmp4/download_result.fragment")
+
+@pytest.fixture(scope='module')
+def only_holder_session():
+    return run_session("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"],
+                       "test/tmp2/download_target.chunkhash", "test/tmp2/download_result.fragment")
+
+def test_other_holder_finish(other_holder_session):
+    session, success, corrupted = other_holder_session
+    assert success == True, "Fail to complete transfer or timeout"
+    assert len(corrupted) == 1, "no DATA pkt corrupted"
+
+def test_other_holder_content(other_holder_session):
+    grader.check_content("test/tmp4/download_result.fragment", ["45acace8e984465459c893197e593c36daf653db"])
+def test_other_holder_used(other_holder_session):
+    session, success, corrupted = other_holder_session
+    holders = {("127.0.0.1", 48002), ("127.0.0.1", 48003)}
+    (other, ) = holders - set(corrupted)
+    recv_record = session.peer_list[("127.0.0.1", 48001)].recv_record
+    assert recv_record.get(other, {}).get(3, 0) > 0, "the chunk is not downloaded from the other holder"
+
+def test_only_holder_finish(only_holder_session):
+    session, success, corrupted = only_holder_session
+    assert success == True, "Fail to complete transfer or timeout"
+    assert len(corrupted) == 1, "no DATA pkt corrupted"
+
+def test_only_holder_content(only_holder_session):
+    grader.check_content("test/tmp2/download_result.fragment", ["3b68110847941b84e8d05417a5b2609122a56314"])
+
+def test_only_holder_asked_again(only_holder_session):
+    session, success, corrupted = only_holder_session
+    send_record = session.peer_list[("127.0.0.1", 48001)].send_record
+    assert send_record[("127.0.0.1", 48002)][2] >= 2, "the only holder is not asked again"
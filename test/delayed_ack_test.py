@@ -0,0 +1,65 @@
+import grader
+import pytest
+import os
+
+'''
+This test examines delayed ACKs.
+With --delayed-ack 4, peer1 should ACK about one in four in-order DATA pkts once the
+first few have been acked one by one, and the chunk should still arrive intact.
+With --delayed-ack 1, every DATA pkt is acked.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1 --delayed-ack 4
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2 --delayed-ack 4
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+
+and then the same with --delayed-ack 1.
+'''
+
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+RESULT = "test/tmp2/download_result.fragment"
+
+def run_session(delayed_ack):
+    if os.path.exists(RESULT):
+        os.remove(RESULT)
+
+    session = grader.GradingSession(grader.normal_handler)
+    session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"],
+                      extra_args=f"--delayed-ack {delayed_ack}")
+    session.run_grader()
+
+    peer1 = session.peer_list[("127.0.0.1", 48001)]
+    peer1.send_cmd(f'''DOWNLOAD test/tmp2/download_target.chunkhash {RESULT}\n''')
+    success = session.wait_for_file(RESULT, 80)
+    session.terminate_peers()
+
+    num_data = peer1.recv_record[("127.0.0.1", 48002)][3]
+    num_acks = peer1.send_record[("127.0.0.1", 48002)][4]
+    return success, num_data, num_acks
+
+@pytest.fixture(scope='module')
+def delayed_session():
+    return run_session(4)
+
+@pytest.fixture(scope='module')
+def every_pkt_session():
+    # runs after delayed_session is done with the result file
+    return run_session(1)
+
+def test_finish(delayed_session):
+    success, num_data, num_acks = delayed_session
+    assert success == True, "Fail to complete transfer or timeout"
+    grader.check_content(RESULT, [TARGET_HASH])
+
+def test_coalesced(delayed_session):
+    success, num_data, num_acks = delayed_session
+    assert num_acks < num_data / 2, f"{num_acks} ACKs for {num_data} DATA pkts"
+
+def test_every_pkt(every_pkt_session):
+    success, num_data, num_acks = every_pkt_session
+    assert success == True, "Fail to complete transfer or timeout"
+    assert num_acks >= num_data, f"{num_acks} ACKs for {num_data} DATA pkts"
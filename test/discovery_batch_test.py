@@ -0,0 +1,80 @@
+import grader
+import time
+import pytest
+import hashlib
+
+'''
+This test examines discovery of a DOWNLOAD with more chunkhashes than fit in one pkt.
+Peer1 asks for 100 chunks, 99 of which no one has and the last one peer2 has. The WHOHAS
+should be split into batches of at most 51 hashes, peer2 should find the chunk in the second
+batch, announce it in an IHAVE and send it when asked.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2
+DOWNLOAD <99 unknown chunkhashes and chunk 3> <result> (in peer1)
+'''
+
+HASHES_PER_PKT = 51
+NUM_HASHES = 100
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+
+@pytest.fixture(scope='module')
+def batch_session():
+    pkts = []
+
+    def record(pkt):
+        if pkt.pkt_type in (0, 1):
+            pkts.append((pkt.pkt_type, pkt.from_addr, pkt.seq, pkt.ack, pkt.payload))
+        return pkt
+
+    target_hashes = [hashlib.sha1(str(i).encode()).hexdigest() for i in range(NUM_HASHES - 1)] + [TARGET_HASH]
+    tmp_dir, target, result = grader.make_download_target(target_hashes)
+
+    batch_session = grader.GradingSession(grader.filter_handler(record))
+    batch_session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"])
+    batch_session.run_grader()
+
+    peer1 = batch_session.peer_list[("127.0.0.1", 48001)]
+    peer1.send_cmd(f'''DOWNLOAD {target} {result}\n''')
+
+    # the DOWNLOAD never finishes, wait for the one chunk someone has to arrive
+    while time.time()-batch_session.start_time<30:
+        if peer1.recv_record.get(("127.0.0.1", 48002), {}).get(3, 0) >= 10:
+            break
+        time.sleep(0.1)
+    batch_session.terminate_peers()
+
+    yield batch_session, pkts
+
+    grader.remove_download(tmp_dir)
+
+def test_whohas_batches(batch_session):
+    session, pkts = batch_session
+    whohas = [pkt for pkt in pkts if pkt[0] == 0 and pkt[1] == ("127.0.0.1", 48001)]
+    assert len(whohas) >= 2, "WHOHAS is not split"
+
+    num_batches = (NUM_HASHES + HASHES_PER_PKT - 1) // HASHES_PER_PKT
+    for _, _, seq, ack, payload in whohas:
+        assert len(payload) <= HASHES_PER_PKT * 20, f"WHOHAS of {len(payload) // 20} hashes"
+        assert ack == num_batches and seq < num_batches, f"bad batch {seq} of {ack}"
+    assert {seq for _, _, seq, _, _ in whohas} == set(range(num_batches))
+
+    # the chunk in the second batch is asked for too
+    asked = b"".join(payload for _, _, _, _, payload in whohas[:num_batches])
+    assert bytes.fromhex(TARGET_HASH) in asked
+
+def test_ihave(batch_session):
+    session, pkts = batch_session
+    ihave = [pkt for pkt in pkts if pkt[0] == 1 and pkt[1] == ("127.0.0.1", 48002)]
+    assert len(ihave) > 0, "no IHAVE from peer2"
+    assert bytes.fromhex(TARGET_HASH) in ihave[0][4]
+
+def test_data(batch_session):
+    session, pkts = batch_session
+    recv_record = session.peer_list[("127.0.0.1", 48001)].recv_record
+    assert recv_record[("127.0.0.1", 48002)][3] >= 10, "the chunk in the second batch is not downloaded"
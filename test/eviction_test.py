@@ -0,0 +1,77 @@
+import grader
+import time
+import pytest
+import os
+
+'''
+This test examines how a sender gives up a receiver that stopped answering.
+After 100 DATA pkts, peer1 and peer2 are cut off from each other for BLACKOUT seconds.
+With --send-ttl 2, peer2 should evict the flow after two unanswered retransmits, at most
+one per timeout interval (up to 1s with --rto-max 1), and go quiet rather than retransmit
+for the whole blackout. Once the two can talk again,
+peer2 has its upload slot back and peer1 should get the chunk from it.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for the blackout):
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1 --send-ttl 2 --rto-max 1
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2 --send-ttl 2 --rto-max 1
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+'''
+
+BLACKOUT_AFTER = 100
+BLACKOUT = 10
+# peer2 should have evicted the flow by then, with a lot of room for backoff
+QUIET_AFTER = 5
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+RESULT = "test/tmp2/download_result.fragment"
+
+@pytest.fixture(scope='module')
+def eviction_session():
+    # start and end of the blackout, and when peer2 sent DATA during it
+    blackout = {"start": None, "end": None, "data": []}
+    num_data = [0]
+
+    def cut_off(pkt):
+        if blackout["start"] is not None and blackout["end"] is None:
+            if pkt.pkt_type == 3:
+                blackout["data"].append(time.time())
+            return None
+        if pkt.pkt_type == 3:
+            num_data[0] += 1
+            if num_data[0] == BLACKOUT_AFTER:
+                blackout["start"] = time.time()
+        return pkt
+
+    if os.path.exists(RESULT):
+        os.remove(RESULT)
+
+    eviction_session = grader.GradingSession(grader.filter_handler(cut_off))
+    eviction_session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"],
+                               extra_args="--send-ttl 2 --rto-max 1")
+    eviction_session.run_grader()
+
+    eviction_session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD test/tmp2/download_target.chunkhash {RESULT}\n''')
+    while blackout["start"] is None and time.time()-eviction_session.start_time<30:
+        time.sleep(0.1)
+    time.sleep(BLACKOUT)
+    blackout["end"] = time.time()
+
+    success = eviction_session.wait_for_file(RESULT, 80)
+    eviction_session.terminate_peers()
+
+    return eviction_session, success, blackout
+
+def test_finish(eviction_session):
+    session, success, blackout = eviction_session
+    assert blackout["start"] is not None, "no blackout"
+    assert success == True, "Fail to complete transfer or timeout"
+    grader.check_content(RESULT, [TARGET_HASH])
+
+def test_quiet(eviction_session):
+    session, success, blackout = eviction_session
+    assert len(blackout["data"]) > 0, "nothing retransmitted in the blackout"
+    late = [t - blackout["start"] for t in blackout["data"] if t - blackout["start"] > QUIET_AFTER]
+    assert late == [], f"peer2 still sends DATA {late} seconds into the blackout"
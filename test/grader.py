@@ -12,10 +12,14 @@ import signal
 import queue
 from concurrent.futures import ThreadPoolExecutor
 import logging
+import pickle
+import hashlib
+import shutil
+import tempfile
 os.chdir(os.path.join(os.path.dirname(__file__), ".."))
 
 class PeerProc:
-    def __init__(self, identity, peer_file_loc, node_map_loc, haschunk_loc, max_transmit = 1, timeout = 60):
+    def __init__(self, identity, peer_file_loc, node_map_loc, haschunk_loc, max_transmit = 1, timeout = 60, extra_args = ""):
         self.id = identity
         self.peer_file_loc = peer_file_loc
         self.node_map_loc = node_map_loc
@@ -25,12 +29,16 @@ class PeerProc:
         self.send_record = dict() #{to_id:{type:cnt}}
         self.recv_record = dict() #{from_id:{type:cnt}}
         self.timeout = timeout
+        # options of the peer beyond the basic ones, e.g. "--cc cubic"
+        self.extra_args = extra_args
 
     def start_peer(self):
         if self.timeout:
             cmd = f"python3 -u {self.peer_file_loc} -p {self.node_map_loc} -c {self.haschunk_loc} -m {self.max_transmit} -i {self.id} -t {self.timeout}"
         else:
             cmd = f"python3 -u {self.peer_file_loc} -p {self.node_map_loc} -c {self.haschunk_loc} -m {self.max_transmit} -i {self.id}"
+        if self.extra_args:
+            cmd += f" {self.extra_args}"
 
         self.process = subprocess.Popen(cmd.split(" "), stdin=subprocess.PIPE,stdout=subprocess.DEVNULL,text=True, bufsize=1, universal_newlines=True)
         # ensure peer is running
@@ -109,10 +117,39 @@ class GradingSession:
     def stop_grader(self):
         self._FINISH = True
 
-    def add_peer(self, identity, peer_file_loc, node_map_loc, haschunk_loc, max_transmit, peer_addr, timeout = 60):
-        peer = PeerProc(identity, peer_file_loc, node_map_loc, haschunk_loc, max_transmit, timeout=timeout)
+    def add_peer(self, identity, peer_file_loc, node_map_loc, haschunk_loc, max_transmit, peer_addr, timeout = 60, extra_args = ""):
+        peer = PeerProc(identity, peer_file_loc, node_map_loc, haschunk_loc, max_transmit, timeout=timeout, extra_args=extra_args)
         self.peer_list[peer_addr] = peer
 
+    def add_peers(self, node_map_loc, haschunk_locs, max_transmit = 1, extra_args = ""):
+        # peer i + 1 has haschunk_locs[i], at its address in the node map
+        for identity, peer_addr in read_nodes_map(node_map_loc).items():
+            if identity <= len(haschunk_locs):
+                self.add_peer(identity, "src/peer.py", node_map_loc, haschunk_locs[identity - 1], max_transmit, peer_addr,
+                              timeout=None, extra_args=extra_args)
+
+    def wait_for_file(self, path, time_max, stime = None):
+        # poll for a file written by a peer, False if it is not there time_max seconds after stime
+        if stime is None:
+            stime = self.start_time
+        while True:
+            if os.path.exists(path):
+                return True
+            elif time.time()-stime>time_max:
+                # Reached max transmission time, abort
+                return False
+
+            time.sleep(0.1)
+
+    def terminate_peers(self):
+        for p in self.peer_list.values():
+            process = p.process
+            if process is None:
+                continue
+            p.terminate_peer()
+            # the next session may reuse the ports
+            process.wait(30)
+
     def run_grader(self):
         # set env
         os.environ["SIMULATOR"] = f"{self.checkerIP}:{self.checkerPort}"
@@ -149,6 +186,58 @@ class GradingSession:
         # grading_worker.join()
         # self._FINISH = True
 
+def read_nodes_map(node_map_loc):
+    nodes = dict()
+    with open(node_map_loc, "r") as node_map:
+        for line in node_map:
+            if line.startswith("#") or not line.strip():
+                continue
+            identity, ip, port = line.split()
+            nodes[int(identity)] = (ip, int(port))
+    return nodes
+
+def make_download_target(chunkhashes):
+    # a target of the given chunkhashes in a new temporary dir, removed by remove_download
+    tmp_dir = tempfile.mkdtemp()
+    target = os.path.join(tmp_dir, "download_target.chunkhash")
+    result = os.path.join(tmp_dir, "download_result.fragment")
+    with open(target, "w") as target_file:
+        target_file.write("\n".join(f"{i + 1} {chunkhash}" for i, chunkhash in enumerate(chunkhashes)))
+    return tmp_dir, target, result
+
+def remove_download(tmp_dir):
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def check_content(result, target_hashes):
+    assert os.path.exists(result), "no downloaded file"
+
+    with open(result, "rb") as download_file:
+        download_fragment = pickle.load(download_file)
+
+    for th in target_hashes:
+        assert th in download_fragment, f"download hash mismatch, target: {th}, has: {download_fragment.keys()}"
+
+        sha1 = hashlib.sha1()
+        sha1.update(download_fragment[th])
+        received_hash_str = sha1.hexdigest()
+
+        assert th.strip() == received_hash_str.strip(), f"received data mismatch, expect hash: {th}, actual: {received_hash_str}"
+
+def filter_handler(on_pkt):
+    # a grading handler passing every pkt through on_pkt, which returns the pkt to forward
+    # (possibly changed) or None to drop it
+    def handler(recv_queue, send_queue):
+        while True:
+            try:
+                pkt = recv_queue.get(timeout=0.01)
+            except:
+                continue
+
+            pkt = on_pkt(pkt)
+            if pkt is not None:
+                send_queue.put(pkt)
+    return handler
+
 def drop_handler(recv_queue, send_queue):
     dropped = False
     last_pkt = 3
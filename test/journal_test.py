@@ -0,0 +1,91 @@
+import grader
+import time
+import pytest
+import pickle
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.packet import CHUNK_DATA_SIZE
+
+'''
+This test examines resuming a DOWNLOAD after the downloading peer crashes.
+Peer1 is downloading 4 chunks from peer2. Once one and a half chunks have arrived, DATA to
+peer1 is held back and peer1 is killed, leaving its download journal behind. Peer1 is then
+started again and given the same DOWNLOAD, it should only fetch what is missing.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data5-8.fragment: 4 chunks, the target
+
+This test is equivalent to run (except for the crash):
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp5/fragments/data5-8.fragment -m 1 -i 2
+DOWNLOAD <the 4 chunks of data5-8.fragment> <result> (in peer1)
+(kill -9 peer1, start it again and DOWNLOAD the same)
+'''
+
+CRASH_AFTER = CHUNK_DATA_SIZE * 3 // 2
+
+@pytest.fixture(scope='module')
+def journal_session():
+    time_max = 80
+    received = [0]
+    hold = []
+
+    def crash(pkt):
+        if pkt.pkt_type == 3 and pkt.to_addr == ("127.0.0.1", 48001):
+            if hold:
+                return None
+            # payload bytes received by peer1 before and after the crash
+            received[-1] += pkt.pkt_len - pkt.header_len
+            if len(received) == 1 and received[0] >= CRASH_AFTER:
+                hold.append(True)
+        return pkt
+
+    with open("test/tmp5/fragments/data5-8.fragment", "rb") as fragment_file:
+        target_hashes = list(pickle.load(fragment_file))
+    tmp_dir, target, result = grader.make_download_target(target_hashes)
+
+    journal_session = grader.GradingSession(grader.filter_handler(crash))
+    journal_session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp5/fragments/data5-8.fragment"])
+    journal_session.run_grader()
+
+    peer1 = journal_session.peer_list[("127.0.0.1", 48001)]
+    peer1.send_cmd(f'''DOWNLOAD {target} {result}\n''')
+
+    while not hold and time.time()-journal_session.start_time<time_max:
+        time.sleep(0.1)
+    # let the journal catch up, then crash peer1
+    time.sleep(2.5)
+    peer1.process.kill()
+    peer1.process.wait()
+    journal_left = os.path.exists(result + ".journal")
+
+    peer1.start_peer()
+    received.append(0)
+    hold.clear()
+    peer1.send_cmd(f'''DOWNLOAD {target} {result}\n''')
+
+    success = journal_session.wait_for_file(result, time_max)
+    journal_session.terminate_peers()
+
+    yield journal_session, success, result, target_hashes, received, journal_left
+
+    grader.remove_download(tmp_dir)
+
+def test_finish(journal_session):
+    session, success, result, target_hashes, received, journal_left = journal_session
+    assert journal_left == True, "no journal left behind by the crash"
+    assert success == True, "Fail to complete transfer or timeout"
+
+def test_content(journal_session):
+    session, success, result, target_hashes, received, journal_left = journal_session
+    grader.check_content(result, target_hashes)
+
+def test_only_missing(journal_session):
+    session, success, result, target_hashes, received, journal_left = journal_session
+    before, after = received
+    assert before >= CRASH_AFTER
+    # at least a chunk of what arrived before the crash is not fetched again
+    assert after <= (len(target_hashes) - 1) * CHUNK_DATA_SIZE, f"{after} bytes fetched after the restart"
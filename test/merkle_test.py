@@ -0,0 +1,72 @@
+import grader
+import pytest
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.packet import CHUNK_DATA_SIZE, MIN_PAYLOAD
+
+'''
+This test examines per-pkt verification with merkle proofs.
+One DATA pkt is corrupted on the way. With --merkle, peer1 should find out from
+the proof in that pkt alone, drop it and have only that pkt sent again, rather
+than failing the sha1 check of the whole chunk and asking for it again.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for the corruption):
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1 --merkle
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2 --merkle
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+'''
+
+CORRUPT_SEQ = 5
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+RESULT = "test/tmp2/download_result.fragment"
+
+@pytest.fixture(scope='module')
+def merkle_session():
+    # times every DATA seq reached peer1
+    data_seqs = dict()
+
+    def corrupt(pkt):
+        if pkt.pkt_type == 3:
+            data_seqs[pkt.seq] = data_seqs.get(pkt.seq, 0) + 1
+            if pkt.seq == CORRUPT_SEQ and data_seqs[pkt.seq] == 1:
+                # flip the first payload byte, the proof is left alone
+                payload = pkt.payload
+                pkt.set_payload(bytes([payload[0] ^ 0xff]) + payload[1:])
+        return pkt
+
+    if os.path.exists(RESULT):
+        os.remove(RESULT)
+
+    merkle_session = grader.GradingSession(grader.filter_handler(corrupt))
+    merkle_session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"],
+                             extra_args="--merkle")
+    merkle_session.run_grader()
+
+    merkle_session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD test/tmp2/download_target.chunkhash {RESULT}\n''')
+    success = merkle_session.wait_for_file(RESULT, 80)
+    merkle_session.terminate_peers()
+
+    return merkle_session, success, data_seqs
+
+def test_finish(merkle_session):
+    session, success, data_seqs = merkle_session
+    assert success == True, "Fail to complete transfer or timeout"
+
+def test_content(merkle_session):
+    grader.check_content(RESULT, [TARGET_HASH])
+
+def test_piece_resent(merkle_session):
+    session, success, data_seqs = merkle_session
+    assert data_seqs.get(CORRUPT_SEQ, 0) >= 2, "the corrupted pkt is not sent again"
+
+    # the chunk is not asked for again, nor sent twice
+    send_record = session.peer_list[("127.0.0.1", 48001)].send_record
+    assert send_record[("127.0.0.1", 48002)][2] == 1, "the chunk is asked for again"
+    num_pkts = (CHUNK_DATA_SIZE + MIN_PAYLOAD - 1) // MIN_PAYLOAD
+    assert sum(data_seqs.values()) < 2 * num_pkts, f"{sum(data_seqs.values())} DATA pkts for {num_pkts}"
@@ -0,0 +1,109 @@
+import grader
+import struct
+import pytest
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.packet import MIN_PAYLOAD
+
+'''
+This test examines the search for the largest DATA payload from a sender.
+In the first session the first GET is changed on the way to ask for a payload no pkt
+can hold, so the holder sends DENIED with reason 1. In the second one every DATA pkt
+with more than PATH_PAYLOAD bytes of payload is cut short on the way. Either way peer1
+should ask again with a smaller payload and finish the chunk with one that gets through.
+
+.fragment files:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for the changed pkts), twice:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+'''
+
+DENIED_PAYLOAD = 1
+PATH_PAYLOAD = 1200
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+RESULT = "test/tmp2/download_result.fragment"
+
+def run_session(on_pkt):
+    if os.path.exists(RESULT):
+        os.remove(RESULT)
+
+    session = grader.GradingSession(grader.filter_handler(on_pkt))
+    session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"])
+    session.run_grader()
+
+    session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD test/tmp2/download_target.chunkhash {RESULT}\n''')
+    success = session.wait_for_file(RESULT, 80)
+    session.terminate_peers()
+    return success
+
+def get_payload_size(pkt):
+    # |20 byte chunkhash|1 byte options|2 byte payload size|4 byte start seq|
+    return struct.unpack_from("!H", pkt.payload, 21)[0]
+
+@pytest.fixture(scope='module')
+def denied_session():
+    gets = []
+    denied = []
+
+    def deny(pkt):
+        if pkt.pkt_type == 2:
+            gets.append(get_payload_size(pkt))
+            if len(gets) == 1:
+                payload = pkt.payload
+                pkt.set_payload(payload[:21] + struct.pack("!H", 0xffff) + payload[23:])
+        elif pkt.pkt_type == 5:
+            denied.append(pkt.ack)
+        return pkt
+
+    success = run_session(deny)
+    return success, gets, denied
+
+@pytest.fixture(scope='module')
+def truncated_session():
+    gets = []
+    # payload sizes of the DATA pkts that got through whole
+    delivered = set()
+
+    def truncate(pkt):
+        if pkt.pkt_type == 2:
+            gets.append(get_payload_size(pkt))
+        elif pkt.pkt_type == 3:
+            payload = pkt.payload
+            if len(payload) > PATH_PAYLOAD:
+                pkt.set_payload(payload[:PATH_PAYLOAD])
+            else:
+                delivered.add(len(payload))
+        return pkt
+
+    success = run_session(truncate)
+    return success, gets, delivered
+
+def test_denied_finish(denied_session):
+    success, gets, denied = denied_session
+    assert success == True, "Fail to complete transfer or timeout"
+    grader.check_content(RESULT, [TARGET_HASH])
+
+def test_denied_fallback(denied_session):
+    success, gets, denied = denied_session
+    assert DENIED_PAYLOAD in denied, f"no DENIED for the payload size: {denied}"
+    assert len(gets) >= 2, "the chunk is not asked for again"
+    assert MIN_PAYLOAD <= gets[1] < gets[0], f"payload sizes asked for: {gets}"
+
+def test_truncated_finish(truncated_session):
+    success, gets, delivered = truncated_session
+    assert success == True, "Fail to complete transfer or timeout"
+    grader.check_content(RESULT, [TARGET_HASH])
+
+def test_truncated_fallback(truncated_session):
+    success, gets, delivered = truncated_session
+    # every failure narrows the search, no payload size is asked for twice
+    assert gets == sorted(set(gets), reverse=True), f"payload sizes asked for: {gets}"
+    assert MIN_PAYLOAD <= gets[-1] <= PATH_PAYLOAD, f"payload sizes asked for: {gets}"
+    # the whole chunk came with the payload size that fits, the last pkt may be shorter
+    assert max(delivered) == gets[-1]
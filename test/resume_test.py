@@ -0,0 +1,116 @@
+import grader
+import time
+import struct
+import pytest
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.packet import CHUNK_DATA_SIZE
+
+'''
+This test examines resuming a chunk from another holder.
+Peer1 is downloading chunk2 from one of peer2 and peer3, after 100 DATA pkts that holder
+goes silent (every pkt from or to it is dropped). Peer1 should ask the other holder for the
+rest of the chunk only, with a ranged GET starting past the pkts it already has.
+When the silent holder is the only one, peer1 should keep it and resume from it once it
+is back, SILENT_FOR seconds later.
+
+.fragment files:
+data4-1.fragment: chunk1
+data4-2.fragment: chunk2
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for the silent holder):
+python3 src/peer.py -p test/tmp4/nodes4.map -c test/tmp4/data4-1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp4/nodes4.map -c test/tmp4/data4-2.fragment -m 1 -i 2
+python3 src/peer.py -p test/tmp4/nodes4.map -c test/tmp4/data4-2.fragment -m 1 -i 3
+DOWNLOAD test/tmp4/download_target4.chunkhash test/tmp4/download_result.fragment (in peer1)
+
+and then:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment (in peer1)
+'''
+
+SILENT_AFTER = 100
+SILENT_FOR = 5
+CHUNK_HASH = "45acace8e984465459c893197e593c36daf653db"
+RESULT = "test/tmp4/download_result.fragment"
+ONLY_HOLDER_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+ONLY_HOLDER_RESULT = "test/tmp2/download_result.fragment"
+
+def run_session(nodes_map, fragments, target, result, silent_for=None):
+    gets = []
+    # DATA pkts seen, and the holder gone silent after SILENT_AFTER of them
+    state = {"data": 0, "silent": None, "since": None}
+
+    def silence(pkt):
+        if pkt.pkt_type == 2:
+            # |20 byte chunkhash|1 byte options|2 byte payload size|4 byte start seq|
+            gets.append((pkt.to_addr, ) + struct.unpack_from("!HI", pkt.payload, 21))
+        if state["silent"] in (pkt.from_addr, pkt.to_addr):
+            if silent_for is None or time.time() - state["since"] < silent_for:
+                return None
+        if pkt.pkt_type == 3:
+            state["data"] += 1
+            if state["data"] == SILENT_AFTER:
+                state["silent"], state["since"] = pkt.from_addr, time.time()
+        return pkt
+
+    if os.path.exists(result):
+        os.remove(result)
+
+    session = grader.GradingSession(grader.filter_handler(silence))
+    session.add_peers(nodes_map, fragments)
+    session.run_grader()
+
+    session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD {target} {result}\n''')
+    success = session.wait_for_file(result, 80)
+    session.terminate_peers()
+
+    return session, success, gets
+
+@pytest.fixture(scope='module')
+def resume_session():
+    return run_session("test/tmp4/nodes4.map",
+                       ["test/tmp4/data4-1.fragment", "test/tmp4/data4-2.fragment", "test/tmp4/data4-2.fragment"],
+                       "test/tmp4/download_target4.chunkhash", RESULT)
+
+@pytest.fixture(scope='module')
+def only_holder_session():
+    return run_session("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"],
+                       "test/tmp2/download_target.chunkhash", ONLY_HOLDER_RESULT, silent_for=SILENT_FOR)
+
+def test_finish(resume_session):
+    session, success, gets = resume_session
+    assert success == True, "Fail to complete transfer or timeout"
+
+def test_content(resume_session):
+    grader.check_content(RESULT, [CHUNK_HASH])
+
+def test_ranged_get(resume_session):
+    session, success, gets = resume_session
+    first_holder = gets[0][0]
+    resumed = [get for get in gets if get[0] != first_holder]
+    assert len(resumed) > 0, "the chunk is not resumed from the other holder"
+
+    other_holder, payload_size, start_seq = resumed[-1]
+    assert start_seq > 0, "the chunk is downloaded again from the start"
+
+    # only the rest of the chunk is sent by the other holder
+    num_pkts = (CHUNK_DATA_SIZE + payload_size - 1) // payload_size
+    recv_record = session.peer_list[("127.0.0.1", 48001)].recv_record
+    assert recv_record[other_holder][3] < num_pkts, "the whole chunk is sent by the other holder"
+
+def test_only_holder_finish(only_holder_session):
+    session, success, gets = only_holder_session
+    assert success == True, "Fail to complete transfer or timeout"
+    grader.check_content(ONLY_HOLDER_RESULT, [ONLY_HOLDER_HASH])
+
+def test_only_holder_resumed(only_holder_session):
+    session, success, gets = only_holder_session
+    # asked again after it stalled, from where it stopped
+    assert len(gets) >= 2, "the only holder is not asked again"
+    assert gets[-1][2] > 0, "the chunk is downloaded again from the start"
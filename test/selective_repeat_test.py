@@ -0,0 +1,176 @@
+import grader
+import pytest
+import logging
+import random
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+from FSM import FSM, State, DUP_THRESH
+from congestion import CongestionControl
+from timer_heap import TimerHeap
+from util.packet import CHUNK_DATA_SIZE, unpack_header
+
+'''
+This test examines selective repeat under random loss.
+About 3% of DATA and ACK pkts are dropped, the sender should only retransmit
+what is lost and the receiver should dump the whole chunk correctly.
+The sender is also driven on its own with SACK ranges, checking what it sends back.
+
+.fragment file:
+data1.fragment: chunk 1,2
+data2.fragment: chunk 3,4
+
+This test is equivalent to run (except for packet loss):
+In shell1:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data1.fragment -m 1 -i 1
+
+In shell2:
+python3 src/peer.py -p test/tmp2/nodes2.map -c test/tmp2/data2.fragment -m 1 -i 2
+
+In shell1:
+DOWNLOAD test/tmp2/download_target.chunkhash test/tmp2/download_result.fragment
+'''
+
+LOSS = 0.03
+TARGET_HASH = "3b68110847941b84e8d05417a5b2609122a56314"
+RESULT = "test/tmp2/download_result.fragment"
+
+@pytest.fixture(scope='module')
+def lossy_session():
+    dropped = {3: 0, 4: 0}
+    rng = random.Random(2022)
+
+    def drop(pkt):
+        if pkt.pkt_type in (3, 4) and rng.random() < LOSS:
+            dropped[pkt.pkt_type] += 1
+            return None
+        return pkt
+
+    if os.path.exists(RESULT):
+        os.remove(RESULT)
+
+    lossy_session = grader.GradingSession(grader.filter_handler(drop))
+    lossy_session.add_peers("test/tmp2/nodes2.map", ["test/tmp2/data1.fragment", "test/tmp2/data2.fragment"])
+    lossy_session.run_grader()
+
+    lossy_session.peer_list[("127.0.0.1", 48001)].send_cmd(f'''DOWNLOAD test/tmp2/download_target.chunkhash {RESULT}\n''')
+    success = lossy_session.wait_for_file(RESULT, 80)
+    lossy_session.terminate_peers()
+
+    return lossy_session, success, dropped
+
+def test_finish(lossy_session):
+    session, success, dropped = lossy_session
+    assert success == True, "Fail to complete transfer or timeout"
+    assert dropped[3] > 0 and dropped[4] > 0, f"no loss injected: {dropped}"
+
+def test_content(lossy_session):
+    grader.check_content(RESULT, [TARGET_HASH])
+
+class RecordingSocket:
+    def __init__(self) -> None:
+        self.sent = []
+
+    def sendto(self, pkt, addr):
+        # DATA pkts are built in a reused buffer
+        self.sent.append(bytes(pkt))
+
+    def take_seqs(self):
+        # seqs of the DATA pkts sent since the last call
+        seqs = [unpack_header(pkt)[5] for pkt in self.sent]
+        self.sent.clear()
+        return seqs
+
+class FixedWindow(CongestionControl):
+    # cwnd only changes when the test sets it
+    def __init__(self, cwnd) -> None:
+        super().__init__()
+        self.cwnd = cwnd
+
+    def on_ack(self, acked, rtt=None, delivered=None):
+        pass
+
+    def on_loss(self):
+        pass
+
+    def on_timeout(self):
+        pass
+
+def sending_fsm(num_sent):
+    # a selective repeat sender with pkts 1..num_sent in flight
+    sock = RecordingSocket()
+    timers = TimerHeap()
+    fsm = FSM(("127.0.0.1", 48001), TARGET_HASH, bytes(CHUNK_DATA_SIZE), 0, logging.getLogger("FSM-TEST"),
+              selective_repeat=True, flow_id=1, timers=timers, cc=FixedWindow(num_sent))
+    fsm.transit(sock, 0)
+    assert sock.take_seqs() == list(range(1, num_sent + 1))
+    return fsm, sock, timers
+
+def recovering_fsm():
+    # pkt 1 of 8 is lost, 2..4 are sacked and 1 is sent again
+    fsm, sock, timers = sending_fsm(8)
+    for end in range(2, 2 + DUP_THRESH):
+        fsm.transit(sock, 0, [(2, end)])
+    assert fsm.state == State.Fast_RECOVERY
+    assert sock.take_seqs() == [1]
+    return fsm, sock
+
+def test_sack_fast_retransmit():
+    recovering_fsm()
+
+def test_sack_infers_loss():
+    fsm, sock = recovering_fsm()
+    # pkt 5 has DUP_THRESH sacked pkts above it, it goes out before new data
+    fsm.transit(sock, 0, [(2, 4), (6, 8)])
+    seqs = sock.take_seqs()
+    assert seqs[0] == 5
+    assert not {2, 3, 4, 6, 7, 8} & set(seqs), f"sacked pkts are sent again: {seqs}"
+    assert seqs[1:] == list(range(9, 9 + len(seqs) - 1))
+
+def test_sack_below_thresh():
+    fsm, sock = recovering_fsm()
+    # one sacked pkt short of inferring pkts 5 and 6 lost
+    fsm.transit(sock, 0, [(2, 4), (7, 6 + DUP_THRESH - 1)])
+    seqs = sock.take_seqs()
+    assert 5 not in seqs and 6 not in seqs
+    assert seqs == list(range(9, 9 + len(seqs)))
+
+def test_sack_cumulative_ack():
+    fsm, sock = recovering_fsm()
+    fsm.transit(sock, 0, [(2, 4), (6, 8)])
+    sock.take_seqs()
+    # the holes are filled, nothing up to the ack or sacked above it is sent again
+    fsm.transit(sock, 8)
+    seqs = sock.take_seqs()
+    assert min(seqs) > 8 and fsm.state == State.CONGESTION_AVOIDANCE
+
+def test_karn():
+    fsm, sock, timers = sending_fsm(2)
+    backoff = fsm.timeout * 2
+    # pkt 1 times out and is sent again, its ACK may be for either copy
+    fsm.expire(sock)
+    assert sock.take_seqs() == [1]
+    fsm.transit(sock, 1)
+    assert fsm.timeout == backoff
+
+    # pkt 2 was only sent once
+    fsm.transit(sock, 2)
+    assert fsm.timeout < backoff
+
+def test_timer_idle():
+    fsm, sock, timers = sending_fsm(2)
+    flow_key = (("127.0.0.1", 48001), 1)
+    assert flow_key in timers
+
+    # the window holds the next pkt back, nothing is left in flight to time
+    fsm.cc.cwnd = 0
+    fsm.transit(sock, 2)
+    assert sock.take_seqs() == []
+    assert flow_key not in timers
+
+    fsm.cc.cwnd = 2
+    fsm.pace(sock)
+    assert sock.take_seqs() == [3, 4]
+    assert flow_key in timers and fsm.timer.seq == 3
@@ -0,0 +1,78 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+from timer_heap import TimerHeap
+
+'''
+This test examines the timer heap shared by the sending flows.
+Keys are disarmed as they come due, earliest first, and rearming or cancelling a key
+leaves a stale heap entry behind that must never surface.
+'''
+
+def test_pop_due_order():
+    timers = TimerHeap()
+    timers.schedule("b", 2)
+    timers.schedule("a", 1)
+    timers.schedule("c", 3)
+
+    assert timers.next_deadline() == 1
+    assert timers.pop_due(2) == ["a", "b"]
+    assert "a" not in timers and "c" in timers and len(timers) == 1
+    assert timers.pop_due(2.5) == []
+    assert timers.pop_due(3) == ["c"]
+    assert timers.next_deadline() is None
+
+def test_cancel():
+    timers = TimerHeap()
+    timers.schedule("a", 1)
+    timers.schedule("b", 2)
+    timers.cancel("a")
+    # cancelling an unknown key is fine
+    timers.cancel("z")
+
+    assert "a" not in timers and len(timers) == 1
+    assert timers.next_deadline() == 2
+    assert timers.pop_due(10) == ["b"]
+
+def test_rearm_later():
+    timers = TimerHeap()
+    timers.schedule("a", 1)
+    timers.schedule("b", 2)
+    # the entry of a at 1 is stale, a comes due at 3
+    timers.schedule("a", 3)
+
+    assert timers.next_deadline() == 2
+    assert timers.pop_due(2) == ["b"]
+    assert timers.pop_due(2.5) == []
+    assert timers.pop_due(3) == ["a"]
+
+def test_rearm_earlier():
+    timers = TimerHeap()
+    timers.schedule("a", 5)
+    timers.schedule("a", 1)
+
+    assert timers.next_deadline() == 1
+    assert timers.pop_due(1) == ["a"]
+    # the stale entry at 5 does not fire a disarmed key
+    assert timers.pop_due(10) == []
+
+def test_cancel_and_schedule_again():
+    timers = TimerHeap()
+    timers.schedule("a", 1)
+    timers.cancel("a")
+    timers.schedule("a", 4)
+
+    assert timers.pop_due(1) == []
+    assert timers.next_deadline() == 4
+    assert timers.pop_due(4) == ["a"]
+    assert len(timers) == 0
+
+def test_tuple_keys():
+    # flows are keyed by (addr, flow id)
+    timers = TimerHeap()
+    flow = (("127.0.0.1", 48001), 1)
+    timers.schedule(flow, 1)
+    timers.schedule((("127.0.0.1", 48001), 2), 1)
+    assert flow in timers
+    assert timers.pop_due(1) == [flow, (("127.0.0.1", 48001), 2)]
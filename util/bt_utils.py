@@ -1,6 +1,17 @@
 import sys
 import os
-import pickle
+from util.chunk_store import load_chunk_store
+
+# defaults of options only known by src/peer.py, its argparse and the modules it configures take them from here
+BATCH = 32                  # max num of pkts read per wakeup
+DELAYED_ACK = 2             # ACK every this many in-order DATA pkts
+MAX_PAYLOAD = 1440          # largest DATA payload probed for
+JOURNAL_SYNC = 1            # seconds between two syncs of the download journal
+RTO_MIN = 0.2               # bounds of retransmission timeouts
+RTO_MAX = 4                 # backed off timeouts stop growing here, so a stalled peer is retried soon
+SEND_TTL = 5                # retransmits in a row without an ACK before the receiver is considered gone
+SEND_IDLE = 30              # or seconds without an ACK
+MAX_BUFFERS = 16            # max num of chunks downloaded concurrently
 
 class BtConfig:
     def __init__(self, args):
@@ -13,9 +24,28 @@ class BtConfig:
         self.haschunks = dict()
         self.verbose = args.v
         self.timeout = args.t
+        # options only known by src/peer.py
+        self.send_ttl = getattr(args, 'send_ttl', SEND_TTL) # evict sending flows after this many unanswered retransmits
+        self.send_idle = getattr(args, 'send_idle', SEND_IDLE) # or this many seconds without ACKs
+        self.rto_min = getattr(args, 'rto_min', RTO_MIN) # bounds of retransmission timeouts
+        self.rto_max = getattr(args, 'rto_max', RTO_MAX)
+        self.selective_repeat = not getattr(args, 'gbn', False)
+        self.pacing = not getattr(args, 'no_pacing', False)  # paced unless --no-pacing, as in src/peer.py
+        self.cc = getattr(args, 'cc', 'reno')            # congestion control of sending flows
+        self.max_buffers = getattr(args, 'max_buffers', MAX_BUFFERS)
+        self.batch = getattr(args, 'batch', BATCH)       # max num of pkts read per wakeup
+        self.recv_ring = getattr(args, 'recv_ring', 0)   # num of slots of the receive thread ring, 0 for no thread
+        self.pkt_cache = getattr(args, 'pkt_cache', 0)   # max num of cached DATA pkts, 0 for no cache
+        self.delayed_ack = getattr(args, 'delayed_ack', DELAYED_ACK)
+        self.max_payload = getattr(args, 'max_payload', MAX_PAYLOAD)
+        self.journal_sync = getattr(args, 'journal_sync', JOURNAL_SYNC)  # 0 for no download journal
+        self.merkle = getattr(args, 'merkle', None)      # None: no per-pkt verification, '': no trusted roots
+        self.merkle_roots = dict()
 
         self.bt_parse_peer_list()
         self.bt_parse_haschunk_list()
+        if self.merkle:
+            self.bt_parse_merkle_roots()
 
         if self.identity == 0:
             print('bt_parse error:  Node identity must not be zero!')
@@ -39,8 +69,16 @@ class BtConfig:
 
 
     def bt_parse_haschunk_list(self):
-        with open(self.has_chunk_file, 'rb') as file:
-            self.haschunks = pickle.load(file)
+        # {sha1 digest: chunkdata} served from a memory-mapped chunk store,
+        # pickled .fragment files are converted when loading
+        self.haschunks = load_chunk_store(self.has_chunk_file)
+
+    def bt_parse_merkle_roots(self):
+        # lines of "index chunkhash root" written by make_data.py --merkle
+        with open(self.merkle, 'r') as file:
+            for line in file:
+                index, chunkhash_str, root_str = line.split()
+                self.merkle_roots[chunkhash_str] = bytes.fromhex(root_str)
 
     def bt_peer_info(self, identity):
         for item in self.peers:
@@ -0,0 +1,175 @@
+import argparse
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+'''
+Chunk store file format, all integers little endian:
+
+|8byte magic "CS305CHK"|4byte version|4byte chunk size|8byte num of chunks|8byte reserved|   header, 32 bytes
+|20byte sha1 digest|8byte offset of chunk data| * num of chunks                              index
+|raw chunk data ...|                                                                           data
+
+The store is read through mmap, so chunk data never enters the Python heap
+and a chunk is served as a zero-copy memoryview of the mapping.
+'''
+
+STORE_MAGIC = b'CS305CHK'
+STORE_VERSION = 1
+BT_CHUNK_SIZE = 512 * 1024
+SHA1_HASH_SIZE = 20
+
+HEADER = struct.Struct('<8sIIQ8x')
+INDEX_ENTRY = struct.Struct('<20sQ')
+
+class ChunkStore():
+    '''
+    Read-only mapping {sha1 digest: chunk data} backed by a chunk store file.
+    Keys are raw 20-byte digests, hex strings are accepted for lookups too.
+    Chunks downloaded at runtime can be added, they are kept as given.
+    '''
+    def __init__(self, file) -> None:
+        # file: a path or an opened binary file object
+        if isinstance(file, (str, os.PathLike)):
+            file = open(file, 'rb')
+        self.__file = file
+        self.__index = dict()                            # digest -> offset of chunk data in the store
+        self.__added = dict()                            # digest -> data of chunks added at runtime
+
+        if os.fstat(file.fileno()).st_size == 0:
+            # nothing to map
+            self.chunk_size = BT_CHUNK_SIZE
+            self.__view = memoryview(b'')
+            return
+        self.__mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__mmap)
+
+        magic, version, self.chunk_size, num_chunks = HEADER.unpack_from(self.__mmap, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f'{getattr(file, "name", file)} is not a chunk store')
+        for i in range(num_chunks):
+            digest, offset = INDEX_ENTRY.unpack_from(self.__mmap, HEADER.size + i * INDEX_ENTRY.size)
+            self.__index[digest] = offset
+
+    @staticmethod
+    def __key(chunkhash):
+        if isinstance(chunkhash, bytes):
+            return chunkhash
+        if isinstance(chunkhash, str):
+            return bytes.fromhex(chunkhash)
+        return bytes(chunkhash)
+
+    def __contains__(self, chunkhash):
+        key = self.__key(chunkhash)
+        return key in self.__index or key in self.__added
+
+    def __getitem__(self, chunkhash):
+        key = self.__key(chunkhash)
+        if key in self.__added:
+            return self.__added[key]
+        offset = self.__index[key]
+        return self.__view[offset: offset + self.chunk_size]
+
+    def __setitem__(self, chunkhash, data):
+        self.__added[self.__key(chunkhash)] = data
+
+    def __iter__(self):
+        yield from self.__index
+        yield from self.__added
+
+    def __len__(self):
+        return len(self.__index) + len(self.__added)
+
+    def keys(self):
+        return list(self)
+
+def is_chunk_store(path):
+    with open(path, 'rb') as file:
+        return file.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+class StoreWriter():
+    '''
+    Writes a chunk store of `num_chunks` chunks into an opened binary file,
+    one chunk at a time.
+    '''
+    def __init__(self, file, num_chunks, chunk_size=BT_CHUNK_SIZE) -> None:
+        self.__file = file
+        self.__num_chunks = num_chunks
+        self.__chunk_size = chunk_size
+        self.__data_start = HEADER.size + num_chunks * INDEX_ENTRY.size
+        self.__added = 0
+
+        file.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, chunk_size, num_chunks))
+        file.truncate(self.__data_start)
+
+    def add(self, digest, data):
+        if self.__added >= self.__num_chunks:
+            raise ValueError('chunk store is full')
+        offset = self.__data_start + self.__added * self.__chunk_size
+        self.__file.seek(HEADER.size + self.__added * INDEX_ENTRY.size)
+        self.__file.write(INDEX_ENTRY.pack(digest, offset))
+        self.__file.seek(offset)
+        self.__file.write(data)
+        self.__added += 1
+
+    def close(self):
+        self.__file.flush()
+
+class FragmentWriter():
+    '''
+    Writes a pickled {chunkhash_str: chunkdata} dict into an opened binary file,
+    one chunk at a time, so the dict never has to be built in memory.
+    The result is read back with a plain pickle.load.
+    '''
+    def __init__(self, file) -> None:
+        self.__file = file
+        file.write(pickle.PROTO + bytes([3]) + pickle.EMPTY_DICT)
+
+    def add(self, chunkhash_str, data):
+        key = chunkhash_str.encode()
+        self.__file.write(pickle.BINUNICODE + struct.pack('<I', len(key)) + key)
+        self.__file.write(pickle.BINBYTES + struct.pack('<I', len(data)))
+        self.__file.write(data)
+        self.__file.write(pickle.SETITEM)
+
+    def close(self):
+        self.__file.write(pickle.STOP)
+        self.__file.flush()
+
+def write_chunk_store(file, chunks, num_chunks, chunk_size=BT_CHUNK_SIZE):
+    '''
+    Write `num_chunks` (digest, data) pairs from the iterable `chunks` into an
+    opened binary file.
+    '''
+    writer = StoreWriter(file, num_chunks, chunk_size)
+    for digest, data in chunks:
+        writer.add(digest, data)
+    writer.close()
+
+def load_chunk_store(path):
+    '''
+    Open a chunk store, or convert a pickled {chunkhash_str: chunkdata} fragment
+    into an anonymous store first.
+    '''
+    if is_chunk_store(path):
+        return ChunkStore(path)
+    with open(path, 'rb') as file:
+        fragment = pickle.load(file)
+    store_file = tempfile.TemporaryFile()
+    write_chunk_store(store_file, ((bytes.fromhex(h), d) for h, d in fragment.items()), len(fragment))
+    return ChunkStore(store_file)
+
+def convert_fragment(fragment_path, store_path):
+    with open(fragment_path, 'rb') as file:
+        fragment = pickle.load(file)
+    with open(store_path, 'wb') as store_file:
+        write_chunk_store(store_file, ((bytes.fromhex(h), d) for h, d in fragment.items()), len(fragment))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a pickled .fragment file into a chunk store')
+    parser.add_argument('input', type=str, help='The pickled fragment file.')
+    parser.add_argument('output', type=str, help='The chunk store file to write.')
+    args = parser.parse_args()
+    convert_fragment(args.input, args.output)
@@ -1,46 +1,97 @@
 import argparse
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import math
 import hashlib
-import pickle
-import sys
+import mmap
+from multiprocessing import Pool
+from util.chunk_store import StoreWriter, FragmentWriter
+from util.merkle import merkle_root
 
 BT_CHUNK_SIZE = 512*1024  # 512K
 SHA1_HASH_SIZE = 20
+PIECE_SIZE = 1024  # payload of a DATA pkt, the leaves of merkle trees
+
+# the input file mapped in each hashing worker
+_input_mmap = None
 
 def chunk_hash(chunk_btyes):
     sha1_hash = hashlib.sha1()
     sha1_hash.update(chunk_btyes)
     return sha1_hash.hexdigest()
 
-def parse_file(file_dir, chunk_num):
+def _init_worker(file_dir):
+    global _input_mmap
+    with open(file_dir, 'rb') as file:
+        _input_mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _hash_chunk_at(i):
+    return chunk_hash(memoryview(_input_mmap)[i * BT_CHUNK_SIZE: (i + 1) * BT_CHUNK_SIZE])
+
+def _hash_chunk_with_root_at(i):
+    chunk_bytes = memoryview(_input_mmap)[i * BT_CHUNK_SIZE: (i + 1) * BT_CHUNK_SIZE]
+    return chunk_hash(chunk_bytes), merkle_root(chunk_bytes, PIECE_SIZE).hex()
+
+def parse_file(file_dir, chunk_num, workers=None, merkle=False):
+    '''
+    Hash the first chunk_num chunks of the file in parallel.
+    Yield (index, chunk hash str) in order, index starts from 1,
+    or (index, (chunk hash str, merkle root str)) with merkle.
+    '''
     file_size = os.path.getsize(file_dir)
     num_max = math.floor(file_size/BT_CHUNK_SIZE)
     if num_max < chunk_num:
         print(f"Requested {chunk_num} chunks out of max number of chunks: {num_max}, using {num_max} instead of {chunk_num}", file=sys.stderr)
     num = min(num_max, chunk_num)
+    if num == 0:
+        return
 
-    data_chunk = []
-    data_hash = []
-
-    with open(file_dir, 'rb') as file:
-        for i in range(num):
-            chunk_byte = file.read(BT_CHUNK_SIZE)
-            data_chunk.append(chunk_byte)
-            data_hash.append(chunk_hash(chunk_byte))
+    with Pool(workers, initializer=_init_worker, initargs=(file_dir,)) as pool:
+        hash_func = _hash_chunk_with_root_at if merkle else _hash_chunk_at
+        for i, hash_str in enumerate(pool.imap(hash_func, range(num), chunksize=4)):
+            yield i + 1, hash_str
 
-    with open("master.chunkhash", 'w') as f:
-        for j in range(len(data_hash)):
-            print(f"{j+1} {data_hash[j]}", file=f)
+def make_data(input_file, outputs, chunk_num, store=False, workers=None, merkle=False):
+    '''
+    outputs: [(output_file, [chunk index])]
+    Write master.chunkhash and every output file in a single pass over the input,
+    chunks are copied straight from the mapped input file and never buffered.
+    With merkle, master.merkle lists the merkle root over PIECE_SIZE pieces of every chunk
+    as "index chunkhash root", which downloaders can use to verify every DATA pkt.
+    '''
+    num = min(os.path.getsize(input_file) // BT_CHUNK_SIZE, chunk_num)
+    my_indexes = [{i for i in my_index if 1 <= i <= num} for _, my_index in outputs]
+    my_hashes = [[] for _ in outputs]
+    with open(input_file, 'rb') as file, open("master.chunkhash", 'w') as f:
+        input_mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(input_file) > 0 else b''
+        input_view = memoryview(input_mmap)
+        files = [open(output_file, "wb") for output_file, _ in outputs]
+        if store:
+            writers = [StoreWriter(wf, len(my_index)) for wf, my_index in zip(files, my_indexes)]
+        else:
+            writers = [FragmentWriter(wf) for wf in files]
 
-    return data_chunk, data_hash
+        merkle_file = open("master.merkle", 'w') if merkle else None
+        for j, hash_str in parse_file(input_file, chunk_num, workers, merkle):
+            if merkle:
+                hash_str, root_str = hash_str
+                print(f"{j} {hash_str} {root_str}", file=merkle_file)
+            print(f"{j} {hash_str}", file=f)
+            chunk_bytes = input_view[(j - 1) * BT_CHUNK_SIZE: j * BT_CHUNK_SIZE]
+            for writer, hashes, my_index in zip(writers, my_hashes, my_indexes):
+                if j in my_index:
+                    writer.add(bytes.fromhex(hash_str) if store else hash_str, chunk_bytes)
+                    hashes.append(hash_str)
 
-def make_data(input_file, output_file, chunk_num, my_index):
-    data_chunk, data_hash = parse_file(input_file, chunk_num)
-    my_data = dict(zip([data_hash[i-1] for i in my_index], [data_chunk[i-1] for i in my_index]))
-    with open(output_file, "wb") as wf:
-        pickle.dump(my_data, wf)
-    print([data_hash[i-1] for i in my_index])
+        for writer, wf in zip(writers, files):
+            writer.close()
+            wf.close()
+        if merkle:
+            merkle_file.close()
+    for hashes in my_hashes:
+        print(hashes)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -48,9 +99,13 @@ if __name__ == '__main__':
     parser.add_argument('output', type=str, help='The location of the output file.')
     parser.add_argument("num", type=int, help='Splitted to how many chunks')
     parser.add_argument('index', type=str, help='index of chunks to be included in the output file')
+    parser.add_argument('--fragment', nargs=2, action='append', default=[], metavar=('OUTPUT', 'INDEX'),
+                        help='another output file and the index of its chunks, written in the same pass')
+    parser.add_argument('--store', action='store_true', help='write indexed chunk stores instead of pickled dicts')
+    parser.add_argument('-j', type=int, help='number of hashing processes, defaults to the number of CPUs', default=None)
+    parser.add_argument('--merkle', action='store_true', help='also write the merkle root of every chunk to master.merkle')
     args = parser.parse_args()
 
     my_input = args.input
-    my_output = args.output
-    my_index = [int(i) for i in args.index.split(",")]
-    make_data(my_input, my_output, args.num, my_index)
\ No newline at end of file
+    outputs = [(output, [int(i) for i in index.split(",")]) for output, index in [(args.output, args.index)] + args.fragment]
+    make_data(my_input, outputs, args.num, args.store, args.j, args.merkle)
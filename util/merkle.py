@@ -0,0 +1,60 @@
+import hashlib
+
+'''
+Merkle tree over the pieces of a chunk, a piece is the payload of one DATA pkt.
+Leaves are sha1(piece), padded with sha1(b'') up to a power of two, and every
+inner node is sha1(left + right). A proof of piece i is the root followed by
+the sibling of every node on the path from leaf i up to the root:
+
+|20byte root|20byte sibling| * depth
+'''
+
+SHA1_HASH_SIZE = 20
+EMPTY_LEAF = hashlib.sha1(b'').digest()
+
+def merkle_tree(data, piece_size):
+    '''
+    Return the tree as a list of levels, levels[0] are the leaves and levels[-1] == [root].
+    '''
+    view = memoryview(data)
+    leaves = [hashlib.sha1(view[i: i + piece_size]).digest() for i in range(0, len(view), piece_size)]
+    width = 1
+    while width < len(leaves):
+        width *= 2
+    leaves += [EMPTY_LEAF] * (width - len(leaves))
+
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([hashlib.sha1(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)])
+    return levels
+
+def merkle_root(data, piece_size):
+    return merkle_tree(data, piece_size)[-1][0]
+
+def merkle_proof(levels, index):
+    '''
+    Proof of the piece at `index` (0-based).
+    '''
+    proof = [levels[-1][0]]
+    for level in levels[:-1]:
+        proof.append(level[index ^ 1])
+        index //= 2
+    return b''.join(proof)
+
+def verify_piece(piece, index, proof):
+    '''
+    Whether the piece at `index` (0-based) is consistent with the proof, return its root if so.
+    '''
+    if len(proof) < SHA1_HASH_SIZE or len(proof) % SHA1_HASH_SIZE != 0:
+        return None
+    proof = bytes(proof)
+    root = proof[:SHA1_HASH_SIZE]
+    node = hashlib.sha1(piece).digest()
+    for i in range(SHA1_HASH_SIZE, len(proof), SHA1_HASH_SIZE):
+        sibling = proof[i: i + SHA1_HASH_SIZE]
+        node = hashlib.sha1(sibling + node if index & 1 else node + sibling).digest()
+        index //= 2
+    if index != 0 or node != root:
+        return None
+    return root
@@ -0,0 +1,104 @@
+import struct
+from collections import OrderedDict
+
+'''
+Packet codec shared by the peer, the sockets and the checker.
+
+|2byte magic|1byte team |1byte type|
+|2byte  header len  |2byte pkt len |
+|      4byte  seq                  |
+|      4byte  ack                  |
+|header extension, e.g. merkle proof|
+|payload ...                       |
+
+All fields are in network byte order. Structs are compiled once, callers
+deal with host order values only.
+'''
+
+MAGIC = 52305
+TEAM = 29
+
+WHOHAS = 0
+IHAVE = 1
+GET = 2
+DATA = 3
+ACK = 4
+DENIED = 5
+
+HEADER = struct.Struct("!HBBHHII")
+HEADER_LEN = HEADER.size
+ACK_FIELD = struct.Struct("!I")
+ACK_OFFSET = 12
+SPIFFY_HEADER = struct.Struct("I4s4sHH")
+# hupsim forwards pkts of up to 2048 bytes, spiffy header included
+MAX_PKT_SIZE = 2032
+CHUNK_DATA_SIZE = 512 * 1024    # DATA seq i of a chunk carries bytes [(i - 1) * payload size, i * payload size)
+MIN_PAYLOAD = 1024              # known to get through every path, GETs without a size ask for it
+
+def unpack_header(pkt):
+    '''
+    (magic, team, type, header len, pkt len, seq, ack) in host order.
+    '''
+    return HEADER.unpack_from(pkt)
+
+def make_packet(pkt_type, payload=b'', seq=0, ack=0, ext=b''):
+    return HEADER.pack(MAGIC, TEAM, pkt_type, HEADER_LEN + len(ext), HEADER_LEN + len(ext) + len(payload),
+                       seq, ack) + ext + payload
+
+def pack_sack(sack_ranges):
+    '''
+    SACK blocks in the payload of ACK pkts
+    |4byte sack start|4byte sack end| * n
+    '''
+    return struct.pack(f"!{2 * len(sack_ranges)}I", *[s for r in sack_ranges for s in r])
+
+def unpack_sack(payload):
+    sack = struct.unpack_from(f"!{len(payload) // 8 * 2}I", payload)
+    return list(zip(sack[0::2], sack[1::2]))
+
+class DataPacker():
+    '''
+    Builds DATA pkts into one reusable buffer with pack_into, payloads are copied
+    straight from a memoryview of the chunk. The returned view is only valid until
+    the next pack, which is fine as sendto copies it.
+    '''
+    def __init__(self, size=MAX_PKT_SIZE) -> None:
+        self.__buf = bytearray(size)
+        self.__view = memoryview(self.__buf)
+
+    def pack(self, seq, ack, payload, ext=b''):
+        hlen = HEADER_LEN + len(ext)
+        plen = hlen + len(payload)
+        HEADER.pack_into(self.__buf, 0, MAGIC, TEAM, DATA, hlen, plen, seq, ack)
+        self.__view[HEADER_LEN: hlen] = ext
+        self.__view[hlen: plen] = payload
+        return self.__view[:plen]
+
+class DataPacketCache():
+    '''
+    LRU cache of prebuilt DATA pkts of hot chunks, shared by all flows sending them.
+    A pkt is cached with ack 0, the ack field (the flow id) is patched in place
+    right before it is sent.
+    '''
+    def __init__(self, max_pkts) -> None:
+        self.max_pkts = max_pkts
+        self.__pkts = OrderedDict()                      # key -> bytearray of the pkt
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, ack, build):
+        '''
+        The pkt of key with the ack field set, build() -> bytes makes it on a miss.
+        '''
+        pkt = self.__pkts.get(key)
+        if pkt is None:
+            self.misses += 1
+            pkt = bytearray(build())
+            self.__pkts[key] = pkt
+            if len(self.__pkts) > self.max_pkts:
+                self.__pkts.popitem(last=False)
+        else:
+            self.hits += 1
+            self.__pkts.move_to_end(key)
+        ACK_FIELD.pack_into(pkt, ACK_OFFSET, ack)
+        return pkt
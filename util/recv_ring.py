@@ -0,0 +1,110 @@
+import socket
+import threading
+from util.simsocket import SPIFFY_HEADER_LEN
+
+class RecvRing():
+    '''
+    Inbound pkts of a SimSocket read by a dedicated thread, so that intake goes on
+    while the protocol thread is busy, socket calls release the GIL.
+    The I/O thread only does recvfrom_into into preallocated slots of a ring, the
+    protocol thread takes pkts out with get_batch and decodes them there.
+    One producer and one consumer, each only moves its own index, so no lock is needed.
+    The ring is selectable: fileno() becomes readable when pkts are waiting.
+    '''
+    def __init__(self, sim_sock, bufsize, num_slots=1024) -> None:
+        self.__sim_sock = sim_sock
+        self.__sock = sim_sock.raw_socket()
+        self.__num_slots = num_slots
+        slot_size = bufsize + SPIFFY_HEADER_LEN
+        self.__slots = [bytearray(slot_size) for _ in range(num_slots)]
+        self.__lens = [0] * num_slots
+        self.__addrs = [None] * num_slots
+        self.__scratch = bytearray(slot_size)            # pkts read while the ring is full are dropped here
+        self.__head = 0                                  # next slot to consume, only moved by the protocol thread
+        self.__tail = 0                                  # next slot to fill, only moved by the I/O thread
+
+        # wakes up select in the protocol thread
+        self.__wake_r, self.__wake_w = socket.socketpair()
+        self.__wake_r.setblocking(False)
+        self.__wake_w.setblocking(False)
+        self.__wake_pending = False
+
+        self.overflows = 0                               # pkts dropped because the ring was full
+        self.max_occupancy = 0
+        self.__running = False
+        self.__thread = threading.Thread(target=self.__run, name='recv-ring', daemon=True)
+
+    def fileno(self):
+        return self.__wake_r.fileno()
+
+    @property
+    def occupancy(self):
+        return self.__tail - self.__head
+
+    def start(self):
+        # wake up now and then to notice stop()
+        self.__sock.settimeout(0.1)
+        self.__running = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        self.__thread.join()
+        self.__wake_r.close()
+        self.__wake_w.close()
+
+    def __run(self):
+        while self.__running:
+            if self.__tail - self.__head >= self.__num_slots:
+                buf = self.__scratch
+            else:
+                buf = self.__slots[self.__tail % self.__num_slots]
+            try:
+                n, addr = self.__sock.recvfrom_into(buf)
+            except (socket.timeout, InterruptedError):
+                continue
+            except OSError:
+                # socket closed
+                return
+            if buf is self.__scratch:
+                self.overflows += 1
+                continue
+            i = self.__tail % self.__num_slots
+            self.__lens[i] = n
+            self.__addrs[i] = addr
+            # publish the slot only once it is filled
+            self.__tail += 1
+            self.max_occupancy = max(self.max_occupancy, self.__tail - self.__head)
+            if not self.__wake_pending:
+                self.__wake()
+
+    def __wake(self):
+        self.__wake_pending = True
+        try:
+            self.__wake_w.send(b'\0')
+        except BlockingIOError:
+            # already readable
+            pass
+
+    def get_batch(self, max_pkts):
+        '''
+        Take up to max_pkts waiting pkts, return a list of (data_bytes, from_addr).
+        '''
+        # clear the wakeup before reading the ring, a pkt published after this wakes us again
+        try:
+            self.__wake_r.recv(4096)
+        except BlockingIOError:
+            pass
+        self.__wake_pending = False
+
+        batch = []
+        while len(batch) < max_pkts and self.__head != self.__tail:
+            i = self.__head % self.__num_slots
+            pkt = bytes(memoryview(self.__slots[i])[:self.__lens[i]])
+            addr = self.__addrs[i]
+            self.__head += 1
+            batch.append(self.__sim_sock.decode(pkt, addr))
+        if self.__head != self.__tail:
+            # more left for the next wakeup
+            self.__wake()
+        return batch
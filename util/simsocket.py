@@ -1,8 +1,15 @@
+import asyncio
 import struct
 import socket
 import logging
 import os
 import sys
+from util.packet import HEADER, SPIFFY_HEADER
+
+# cumulative count of datagrams dropped by the kernel for a socket, delivered by recvmsg, Linux only
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+SPIFFY_HEADER_LEN = SPIFFY_HEADER.size
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
 
 class SimSocket():
     __glSrcAddr = 0
@@ -10,13 +17,28 @@ class SimSocket():
     __giSpiffyEnabled = False
     __glNodeID = 0
     __gsSpiffyAddr = 0
-    __spiffyHeaderLen = struct.calcsize("I4s4sHH")
-    __stdHeaderLen = struct.calcsize("HBBHHII")
+    __spiffyHeaderLen = SPIFFY_HEADER_LEN
     
     def __init__(self, id, address, verbose = 2) -> None:
         self.__address = address
         self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__sock.bind(address)
+        self.__spiffy_heads = dict()                # dest addr -> spiffy header
+        self.__from_addrs = dict()                  # addrs in a received spiffy header -> from addr
+        self.__recv_buf = bytearray(2048)
+        self.__recv_view = memoryview(self.__recv_buf)
+        # counters of recv_batch
+        self.batches = 0
+        self.batched_pkts = 0
+        self.max_batch = 0
+        self.kernel_drops = None                    # None if the kernel does not report drops
+        self.send_drops = 0                         # pkts dropped as the send buffer of a non-blocking socket was full
+        if SO_RXQ_OVFL is not None:
+            try:
+                self.__sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.kernel_drops = 0
+            except OSError:
+                pass
         self.__logger = logging.getLogger(f"PEER{id}_LOGGER")
         self.__logger.setLevel(logging.DEBUG)
         formatter = logging.Formatter(fmt="%(asctime)s -+- %(name)s -+- %(levelname)s -+- %(message)s")
@@ -48,56 +70,138 @@ class SimSocket():
 
     def fileno(self):
         return self.__sock.fileno()
+
+    def setblocking(self, flag):
+        self.__sock.setblocking(flag)
     
+    def raw_socket(self):
+        return self.__sock
+
     def sendto(self, data_bytes, address, flags = 0) -> int:
-        ip, port = address
-        magic, team, pkt_type, header_len, pkt_len, seq, ack = struct.unpack("!HBBHHII", data_bytes[:self.__stdHeaderLen])
-        if not self.__giSpiffyEnabled:
-            self.__logger.debug(f"sending a type{pkt_type} pkt to {address} via normal socket, seq{seq}, ack{ack}, pkt_len{pkt_len}")
-            return self.__sock.sendto(data_bytes, flags, address)
-        
-        s_head_lDestAddr = socket.inet_aton(ip)
-        s_head_lDestPort = socket.htons(port)
-        s_head_ID = socket.htonl(self.__glNodeID)
-        s_head_lSrcAddr = socket.inet_aton(self.__glSrcAddr)
-        s_head_lSrcPort = socket.htons(self.__gsSrcPort)
+        '''
+        On a non-blocking socket with a full send buffer the pkt is dropped
+        and 0 returned, as if it was lost on the way, senders retransmit it.
+        '''
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__log_pkt("sending", "to", data_bytes, address)
+        try:
+            if not self.__giSpiffyEnabled:
+                return self.__sock.sendto(data_bytes, flags, address)
+
+            # scatter-gather, the payload is never copied to put the spiffy header in front
+            s_head = self.__spiffy_head(address)
+            if HAS_SENDMSG:
+                ret = self.__sock.sendmsg([s_head, data_bytes], [], flags, self.__gsSpiffyAddr)
+            else:
+                ret = self.__sock.sendto(s_head + data_bytes, flags, self.__gsSpiffyAddr)
+            return ret - len(s_head)
+        except (BlockingIOError, socket.timeout):
+            # socket.timeout when the recv ring has given the socket a timeout
+            self.send_drops += 1
+            return 0
 
-        s_head = struct.pack("I4s4sHH", s_head_ID, s_head_lSrcAddr, s_head_lDestAddr, s_head_lSrcPort, s_head_lDestPort)
+    def encode(self, data_bytes, address):
+        '''
+        Return the datagram carrying data_bytes to address and where to send it,
+        that is the simulator with a spiffy header in front if it is on.
+        '''
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__log_pkt("sending", "to", data_bytes, address)
+        if not self.__giSpiffyEnabled:
+            return data_bytes, address
+        return self.__spiffy_head(address) + data_bytes, self.__gsSpiffyAddr
 
-        s_bytes= s_head + data_bytes
+    def __spiffy_head(self, address):
+        # spiffy headers only depend on the destination, built once per peer
+        s_head = self.__spiffy_heads.get(address)
+        if s_head is None:
+            ip, port = address
+            s_head_lDestAddr = socket.inet_aton(ip)
+            s_head_lDestPort = socket.htons(port)
+            s_head_ID = socket.htonl(self.__glNodeID)
+            s_head_lSrcAddr = socket.inet_aton(self.__glSrcAddr)
+            s_head_lSrcPort = socket.htons(self.__gsSrcPort)
 
-        self.__logger.debug(f"sending a type{pkt_type} pkt to {address} via spiffy, seq{seq}, ack{ack}, pkt_len{pkt_len}")
-        ret = self.__sock.sendto(s_bytes, flags, self.__gsSpiffyAddr)
-        return ret - len(s_head)
+            s_head = SPIFFY_HEADER.pack(s_head_ID, s_head_lSrcAddr, s_head_lDestAddr, s_head_lSrcPort, s_head_lDestPort)
+            self.__spiffy_heads[address] = s_head
+        return s_head
 
     def recvfrom(self, bufsize, flags=0):
-        if not self.__giSpiffyEnabled:
-            ret = self.__sock.recvfrom(bufsize, flags)
-            magic, team, pkt_type, header_len, pkt_len, seq, ack = struct.unpack("!HBBHHII", ret[0][:self.__stdHeaderLen])
-            self.__logger.debug(f"Receiving a type{pkt_type} pkt from {ret[1]} via normal socket, seq{seq}, ack{ack}, pkt_len{pkt_len}")
-            return ret
+        data_bytes, from_addr = self.recvfrom_view(bufsize, flags)
+        return (bytes(data_bytes), from_addr)
+
+    def recvfrom_view(self, bufsize, flags=0):
+        '''
+        Like recvfrom, but the pkt is read into a reusable buffer and returned as a
+        memoryview, which is only valid until the next call.
+        '''
+        if self.__giSpiffyEnabled:
+            bufsize += self.__spiffyHeaderLen
+        if bufsize > len(self.__recv_buf):
+            self.__recv_buf = bytearray(bufsize)
+            self.__recv_view = memoryview(self.__recv_buf)
+        n, addr = self.__sock.recvfrom_into(self.__recv_buf, bufsize, flags)
+        return self.decode(self.__recv_view[:n], addr)
 
-        ret = self.__sock.recvfrom(bufsize+self.__spiffyHeaderLen, flags)
+    def recv_batch(self, bufsize, max_pkts):
+        '''
+        Read up to max_pkts datagrams that are already queued, without blocking
+        for more. The socket should be non-blocking, see setblocking.
+        Return a list of (data_bytes, from_addr).
+        '''
+        if self.__giSpiffyEnabled:
+            bufsize += self.__spiffyHeaderLen
+        ancbufsize = socket.CMSG_SPACE(4) if self.kernel_drops is not None else 0
+        batch = []
+        while len(batch) < max_pkts:
+            try:
+                data_bytes, ancdata, _, addr = self.__sock.recvmsg(bufsize, ancbufsize)
+            except (BlockingIOError, InterruptedError):
+                break
+            for level, cmsg_type, cmsg_data in ancdata:
+                if level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL and len(cmsg_data) >= 4:
+                    self.kernel_drops = struct.unpack("I", cmsg_data[:4])[0]
+            batch.append(self.decode(data_bytes, addr))
+        if batch:
+            self.batches += 1
+            self.batched_pkts += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+        return batch
 
-        if ret is not None:
-            simu_bytes, addr = ret
-            _, s_head_lSrcAddr, s_head_lDestAddr, s_head_lSrcPort, s_head_lDestPort = struct.unpack("I4s4sHH", simu_bytes[:self.__spiffyHeaderLen])
+    def decode(self, simu_bytes, addr):
+        '''
+        Return (data_bytes, from_addr) of a datagram read from the socket,
+        stripping the spiffy header if the simulator is on.
+        data_bytes is a slice of simu_bytes, so a memoryview stays a memoryview.
+        '''
+        if not self.__giSpiffyEnabled:
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                self.__log_pkt("Receiving", "from", simu_bytes, addr)
+            return (simu_bytes, addr)
+
+        # src addr, dst addr, src port, dst port of the spiffy header
+        addrs = bytes(simu_bytes[4:self.__spiffyHeaderLen])
+        from_addr = self.__from_addrs.get(addrs)
+        if from_addr is None:
+            _, s_head_lSrcAddr, s_head_lDestAddr, s_head_lSrcPort, s_head_lDestPort = SPIFFY_HEADER.unpack_from(simu_bytes)
             from_addr = (socket.inet_ntoa(s_head_lSrcAddr), socket.ntohs(s_head_lSrcPort))
             to_addr = (socket.inet_ntoa(s_head_lDestAddr), socket.ntohs(s_head_lDestPort))
-            data_bytes = simu_bytes[self.__spiffyHeaderLen:]
-
-            magic, team, pkt_type, header_len, pkt_len, seq, ack = struct.unpack("!HBBHHII", data_bytes[:self.__stdHeaderLen])
-            self.__logger.debug(f"Receiving a type{pkt_type} pkt from {from_addr} via spiffy, seq{seq}, ack{ack}, pkt_len{pkt_len}")
             # check if spiffy header intact
             if not to_addr == self.__address:
                 self.__logger.error("Packet header corrupted, please check bytes read.")
                 raise Exception("Packet header corrupted!")
-
-        else:
-            self.__logger.error("Error on simulator recvfrom")
-        
+            self.__from_addrs[addrs] = from_addr
+        data_bytes = simu_bytes[self.__spiffyHeaderLen:]
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__log_pkt("Receiving", "from", data_bytes, from_addr)
         return (data_bytes, from_addr)
 
+    def __log_pkt(self, action, direction, data_bytes, address):
+        # callers check the logger level first, headers are not decoded when DEBUG lines are off
+        magic, team, pkt_type, header_len, pkt_len, seq, ack = HEADER.unpack_from(data_bytes)
+        via = "spiffy" if self.__giSpiffyEnabled else "normal socket"
+        self.__logger.debug(f"{action} a type{pkt_type} pkt {direction} {address} via {via}, seq{seq}, ack{ack}, pkt_len{pkt_len}")
+
     def __simulator_init(self, nodeid):
         simulator_env = os.getenv("SIMULATOR")
         if simulator_env is None:
@@ -126,4 +230,34 @@ class SimSocket():
 
     def close(self):
         self.__logger.info("socket closed")
-        self.__sock.close()
\ No newline at end of file
+        self.__sock.close()
+
+class SimDatagramProtocol(asyncio.DatagramProtocol):
+    '''
+    asyncio counterpart of SimSocket, to be created on SimSocket.raw_socket().
+    Datagrams are decoded by the SimSocket and passed to handler(protocol, data_bytes, from_addr),
+    and sendto() encodes them the same way, so the protocol can be used in place of the socket.
+    '''
+    def __init__(self, sim_sock, handler) -> None:
+        self.__sim_sock = sim_sock
+        self.__handler = handler
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        data_bytes, from_addr = self.__sim_sock.decode(data, addr)
+        self.__handler(self, data_bytes, from_addr)
+
+    def error_received(self, exc):
+        self.__sim_sock.add_log(f"socket error: {exc}")
+
+    def sendto(self, data_bytes, address, flags = 0) -> int:
+        s_bytes, to_addr = self.__sim_sock.encode(data_bytes, address)
+        self.transport.sendto(s_bytes, to_addr)
+        return len(data_bytes)
+
+    def close(self):
+        self.transport.close()
+        self.__sim_sock.close()
\ No newline at end of file